@@ -1,14 +1,261 @@
+import contextvars
+import json
+import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
 
 import requests
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
+from prometheus_client import Counter, Histogram
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from response_cache import MemoryBackend, RedisBackend, ResponseCache, normalize_key
+from series import FREQUENCIES, TIMEFRAMES, combine_series
+from telemetry import instrument, setup_logging, span, trace_headers
+
+setup_logging("aggregator")
+log = logging.getLogger("aggregator")
 
 app = Flask(__name__)
 CORS(app)
+instrument(app)
+
+UPSTREAM_SECONDS = Histogram(
+    "notibolsa_upstream_seconds", "Latency of calls to the worker and COLCAP services", ["service", "outcome"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 180),
+)
+RESPONSE_CACHE_REQUESTS = Counter("notibolsa_response_cache_requests", "/aggregate cache lookups", ["result"])
 
 COMMONCRAWL_SERVICE = os.getenv("COMMONCRAWL_SERVICE", "http://127.0.0.1:5003/process")
 COLCAP_SERVICE = os.getenv("COLCAP_SERVICE", "http://127.0.0.1:5001/colcap")
+COMMONCRAWL_STREAM = os.getenv("COMMONCRAWL_STREAM", COMMONCRAWL_SERVICE + "/stream")
+COMMONCRAWL_JOBS = os.getenv("COMMONCRAWL_JOBS", COMMONCRAWL_SERVICE.rsplit("/", 1)[0] + "/jobs")
+
+# Plazos por servicio y presupuesto total de /aggregate (segundos)
+COMMONCRAWL_TIMEOUT = float(os.getenv("COMMONCRAWL_TIMEOUT", 180))
+COLCAP_TIMEOUT = float(os.getenv("COLCAP_TIMEOUT", 80))
+AGGREGATE_BUDGET = float(os.getenv("AGGREGATE_BUDGET", 180))
+COMMONCRAWL_SUBMIT_TIMEOUT = float(os.getenv("COMMONCRAWL_SUBMIT_TIMEOUT", 10))
+
+# Sesión HTTP compartida con conexiones keep-alive hacia los servicios internos
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 16))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 1))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", 0.5))
+
+# Series derivadas de "combined": ventana de la correlación móvil y rezago máximo (en periodos)
+ANALYTICS_WINDOW = int(os.getenv("ANALYTICS_WINDOW", 3))
+ANALYTICS_MAX_LAG = int(os.getenv("ANALYTICS_MAX_LAG", 3))
+
+
+def make_session() -> requests.Session:
+    # Solo se reintentan fallos de conexión y 502/503/504: un read timeout volvería a lanzar un escaneo completo
+    retry = Retry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=0,
+        status=HTTP_RETRIES,
+        other=0,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=("GET",),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+http = make_session()
+
+# Caché de respuestas de /aggregate: en memoria o en un servidor compatible con Redis
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 600))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 ** 2))
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "")
+
+
+def make_cache_backend():
+    if RESPONSE_CACHE_URL:
+        try:
+            return RedisBackend(RESPONSE_CACHE_URL)
+        except RuntimeError as e:
+            log.warning("%s; usando caché en memoria", e)
+    return MemoryBackend(RESPONSE_CACHE_MAX_BYTES)
+
+
+response_cache = ResponseCache(make_cache_backend(), RESPONSE_CACHE_TTL)
+
+# Hilos compartidos para consultar los servicios en paralelo
+upstream_pool = ThreadPoolExecutor(max_workers=int(os.getenv("UPSTREAM_WORKERS", 16)))
+
+
+def submit_upstream(fn, *args):
+    """Run fn on the upstream pool inside the current trace."""
+    return upstream_pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+def upstream_get(service: str, url: str, **kwargs):
+    """GET an internal service, propagating the trace and timing the call."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with span("GET " + service, url=url):
+            resp = http.get(url, headers=trace_headers(), **kwargs)
+        outcome = str(resp.status_code)
+        return resp
+    finally:
+        UPSTREAM_SECONDS.labels(service, outcome).observe(time.perf_counter() - started)
+
+
+def fetch_commoncrawl(cc_params: dict) -> dict:
+    log.debug("Enviando a CommonCrawl: %s", cc_params)
+    cc_resp = upstream_get("commoncrawl", COMMONCRAWL_SERVICE, params=cc_params, timeout=COMMONCRAWL_TIMEOUT)
+    log.debug("Respuesta CommonCrawl: %s (%d bytes)", cc_resp.status_code, len(cc_resp.content))
+    # Un 4xx/5xx del worker es un error del upstream aunque traiga un cuerpo JSON
+    cc_resp.raise_for_status()
+    return cc_resp.json()
+
+
+def fetch_colcap(start: str, end: str, granularity: str = "month"):
+    log.debug("Enviando a COLCAP: start=%s end=%s granularity=%s", start, end, granularity)
+    colcap_resp = upstream_get(
+        "colcap", COLCAP_SERVICE, params={"start": start, "end": end, "timeframe": TIMEFRAMES[granularity]},
+        timeout=COLCAP_TIMEOUT,
+    )
+    log.debug("Respuesta COLCAP: %s (%d bytes)", colcap_resp.status_code, len(colcap_resp.content))
+    colcap_resp.raise_for_status()
+    return colcap_resp.json()
+
+
+def submit_commoncrawl_job(cc_params: dict) -> dict:
+    log.debug("Creando job en CommonCrawl: %s", cc_params)
+    job_resp = http.post(COMMONCRAWL_JOBS, json=cc_params, headers=trace_headers(), timeout=COMMONCRAWL_SUBMIT_TIMEOUT)
+    job_resp.raise_for_status()
+    return job_resp.json()
+
+
+def fetch_commoncrawl_job(job_id: str) -> dict:
+    job_resp = upstream_get("commoncrawl", f"{COMMONCRAWL_JOBS}/{job_id}", timeout=COMMONCRAWL_SUBMIT_TIMEOUT)
+    job_resp.raise_for_status()
+    return job_resp.json()
+
+
+def collect(futures: dict, deadlines: dict, budget_end: float) -> tuple[dict, dict]:
+    """
+    Wait for each upstream future until its own deadline or the overall budget,
+    whichever comes first. Returns (results, status) keyed by source name;
+    sources that time out or fail are missing from results.
+    """
+    results, status = {}, {}
+    for name, future in futures.items():
+        remaining = max(0.0, min(deadlines[name], budget_end) - time.monotonic())
+        try:
+            results[name] = future.result(timeout=remaining)
+            status[name] = "ok"
+        except FutureTimeout:
+            future.cancel()
+            log.warning("%s timeout", name)
+            status[name] = "timeout"
+        except Exception as e:
+            log.error("%s error: %s", name, e)
+            status[name] = "error"
+    return results, status
+
+
+def analytics_params(args) -> dict:
+    """
+    Read granularity, window and max_lag for the combined series.
+    Raises ValueError for invalid values.
+    """
+    options = {
+        "granularity": args.get("granularity", "month"),
+        "window": int(args.get("window", ANALYTICS_WINDOW)),
+        "max_lag": int(args.get("max_lag", ANALYTICS_MAX_LAG)),
+    }
+    if options["granularity"] not in FREQUENCIES:
+        raise ValueError(f"granularity must be one of {', '.join(FREQUENCIES)}")
+    # Con dos puntos cualquier correlación vale ±1
+    if options["window"] < 3 or options["max_lag"] < 0:
+        raise ValueError("window must be at least 3 and max_lag not negative")
+    return options
+
+
+def commoncrawl_params(term, keyword, index, start, end, granularity="month") -> dict:
+    cc_params = {"term": term, "granularity": granularity}
+    if keyword:
+        cc_params["keyword"] = keyword
+    if index:
+        cc_params["index"] = index
+    if start:
+        cc_params["start_date"] = start
+    if end:
+        cc_params["end_date"] = end
+    return cc_params
+
+
+def query_upstreams(commoncrawl_call, start, end, granularity="month") -> dict:
+    """
+    Run `commoncrawl_call()` and the COLCAP query in parallel and return
+    the partial response with "commoncrawl", "colcap" and "status".
+    """
+    started = time.monotonic()
+    futures = {"commoncrawl": submit_upstream(commoncrawl_call)}
+    deadlines = {"commoncrawl": started + COMMONCRAWL_TIMEOUT}
+    if start and end:
+        futures["colcap"] = submit_upstream(fetch_colcap, start, end, granularity)
+        deadlines["colcap"] = started + COLCAP_TIMEOUT
+
+    results, status = collect(futures, deadlines, started + AGGREGATE_BUDGET)
+    if "colcap" not in futures:
+        status["colcap"] = "skipped"
+
+    return {
+        "commoncrawl": results.get("commoncrawl", {"error": "CommonCrawl failed"}),
+        "colcap": results.get("colcap", []),
+        "status": status,
+    }
+
+
+def commoncrawl_status(result: dict) -> str:
+    """
+    "partial" when the worker stopped at its deadline or reports CDX pages or
+    WARC ranges it could not fetch, else "ok".
+    """
+    if not isinstance(result, dict):
+        return "ok"
+    failures = result.get("failures")
+    return "partial" if result.get("timed_out") or (failures and failures.get("count")) else "ok"
+
+
+def build_response(term, keyword, index, start, end, granularity) -> dict:
+    """Query both upstream services; the series are combined per request, after the cache."""
+    cc_params = commoncrawl_params(term, keyword, index, start, end, granularity)
+    response = query_upstreams(lambda: fetch_commoncrawl(cc_params), start, end, granularity)
+    if response["status"]["commoncrawl"] == "ok":
+        # Un resultado incompleto no se guarda en caché (ver is_complete)
+        response["status"]["commoncrawl"] = commoncrawl_status(response["commoncrawl"])
+    return response
+
+
+def combine(response: dict, options: dict) -> dict:
+    """Join the CommonCrawl counts with the COLCAP series; returns "combined" and "analytics"."""
+    started = time.perf_counter()
+    result = combine_series(
+        response.get("commoncrawl", {}), response.get("colcap", []),
+        options["granularity"], options["window"], options["max_lag"],
+    )
+    log.debug("Datos combinados: %d filas en %.1fms", len(result["combined"]), (time.perf_counter() - started) * 1e3)
+    return result
+
+
+def is_complete(response: dict) -> bool:
+    """Only responses where every upstream answered are cached."""
+    return all(status in ("ok", "skipped") for status in response["status"].values())
 
 
 @app.route("/aggregate", methods=["GET"])
@@ -21,91 +268,161 @@ def aggregate():
 
     if not term:
         return jsonify({"error": "Missing term"}), 400
+    try:
+        options = analytics_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    granularity = options["granularity"]
 
-    response = {}
+    if request.args.get("async", "").lower() in ("1", "true", "yes"):
+        # Modo job: devolver COLCAP y un identificador para consultar CommonCrawl después
+        cc_params = commoncrawl_params(term, keyword, index, start, end, granularity)
+        response = query_upstreams(lambda: submit_commoncrawl_job(cc_params), start, end, granularity)
+        job = response["commoncrawl"]
+        if response["status"]["commoncrawl"] == "ok":
+            response["status"]["commoncrawl"] = "pending"
+            response["commoncrawl"] = {
+                "job_id": job["job_id"],
+                "status_url": f"/aggregate/jobs/{job['job_id']}",
+            }
+        response.update(combine(response, options))
+        return jsonify(response), 202
+
+    key = normalize_key(term, keyword, index, start, end, granularity)
+    result, source = response_cache.get_or_compute(
+        key, lambda: build_response(term, keyword, index, start, end, granularity), is_complete
+    )
+    RESPONSE_CACHE_REQUESTS.labels(source).inc()
+    # El resultado puede estar compartido con otras peticiones en vuelo: no modificarlo
+    resp = jsonify({**result, **combine(result, options)})
+    resp.headers["X-Cache"] = source
+    return resp
 
-    # -------- CommonCrawl --------
-    try:
-        cc_params = {"term": term}
-        if keyword:
-            cc_params["keyword"] = keyword
-        if index:
-            cc_params["index"] = index
-        if start:
-            cc_params["start_date"] = start
-        if end:
-            cc_params["end_date"] = end
-
-        print("[Aggregator] Enviando a CommonCrawl:", cc_params)
-        cc_resp = requests.get(COMMONCRAWL_SERVICE, params=cc_params, timeout=180)
-        print("[Aggregator] Respuesta CommonCrawl:", cc_resp.status_code)
-        print("[Aggregator] JSON CommonCrawl:", cc_resp.json())
-        response["commoncrawl"] = cc_resp.json()
 
+def stream_aggregate(term, keyword, index, start, end, options):
+    """
+    Proxy the worker's /process/stream and merge every update with the COLCAP
+    series, yielding events with the same keys as /aggregate plus "type".
+    """
+    granularity = options["granularity"]
+    colcap_future = submit_upstream(fetch_colcap, start, end, granularity) if start and end else None
+    colcap = {"data": [], "status": "skipped" if colcap_future is None else "pending"}
+
+    def poll_colcap(wait: float = 0):
+        if colcap["status"] != "pending":
+            return
+        try:
+            colcap["data"] = colcap_future.result(timeout=wait)
+            colcap["status"] = "ok"
+        except FutureTimeout:
+            if wait:
+                colcap["status"] = "timeout"
+        except Exception as e:
+            log.error("COLCAP error: %s", e)
+            colcap["status"] = "error"
+
+    def event(kind: str, cc: dict, cc_status: str) -> dict:
+        response = {
+            "type": kind,
+            "commoncrawl": cc,
+            "colcap": colcap["data"],
+            "status": {"commoncrawl": cc_status, "colcap": colcap["status"]},
+        }
+        response.update(combine(response, options))
+        return response
+
+    cc_params = commoncrawl_params(term, keyword, index, start, end, granularity)
+    last = {}
+    try:
+        with http.get(
+            COMMONCRAWL_STREAM, params=cc_params, stream=True, headers=trace_headers(),
+            timeout=(COMMONCRAWL_SUBMIT_TIMEOUT, COMMONCRAWL_TIMEOUT),
+        ) as cc_resp:
+            cc_resp.raise_for_status()
+            for line in cc_resp.iter_lines():
+                if not line:
+                    continue
+                update = json.loads(line)
+                kind = update.pop("type", "progress")
+                if kind == "result":
+                    last = update
+                    break
+                if kind == "error":
+                    raise RuntimeError(update.get("error"))
+                poll_colcap()
+                yield event("progress", update, "running")
     except Exception as e:
-        print("CommonCrawl error:", e)
-        response["commoncrawl"] = {"error": "CommonCrawl failed"}
+        log.error("CommonCrawl stream error: %s", e)
+        poll_colcap(COLCAP_TIMEOUT)
+        yield event("result", {"error": "CommonCrawl failed"}, "error")
+        return
+    poll_colcap(COLCAP_TIMEOUT)
+    yield event("result", last, commoncrawl_status(last))
 
-    # -------- COLCAP --------
+
+@app.route("/aggregate/stream", methods=["GET"])
+def aggregate_stream():
+    """
+    Streaming variant of /aggregate: NDJSON by default, Server-Sent Events with
+    format=sse or an Accept: text/event-stream header.
+    """
+    term = request.args.get("term")
+    if not term:
+        return jsonify({"error": "Missing term"}), 400
     try:
-        if start and end:
-            print("[Aggregator] Enviando a COLCAP:", {"start": start, "end": end})
-            colcap_resp = requests.get(
-                COLCAP_SERVICE, params={"start": start, "end": end}, timeout=80
-            )
-            print("[Aggregator] Respuesta COLCAP:", colcap_resp.status_code)
-            print("[Aggregator] JSON COLCAP:", colcap_resp.json())
-            response["colcap"] = colcap_resp.json()
-        else:
-            response["colcap"] = []
+        options = analytics_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    sse = request.args.get("format") == "sse" or "text/event-stream" in request.headers.get("Accept", "")
+    events = stream_aggregate(
+        term,
+        request.args.get("keyword"),
+        request.args.get("index"),
+        request.args.get("start"),
+        request.args.get("end"),
+        options,
+    )
+
+    def body():
+        for item in events:
+            data = json.dumps(item)
+            yield f"event: {item['type']}\ndata: {data}\n\n" if sse else data + "\n"
+
+    return Response(
+        stream_with_context(body()),
+        mimetype="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    except Exception as e:
-        print("COLCAP error:", e)
-        response["colcap"] = []
-
-    # -------- COMBINAR POR FECHA --------
-    combined = []
-    colcap_data = response.get("colcap", [])
-    if isinstance(colcap_data, dict) and "data" in colcap_data:
-        colcap_data = colcap_data["data"]
-    cc = response.get("commoncrawl", {})
-    news_by_date = {}
-    if "date_ranges_counts" in cc:
-        for date, count in cc["date_ranges_counts"]:
-            news_by_date[date] = count
-    else:
-        total_news = cc.get("news_count") or cc.get("count") or 0
-        for item in colcap_data:
-            if isinstance(item, dict) and "date" in item:
-                news_by_date[item["date"]] = total_news
-
-    # --- AJUSTE PARA UN SOLO DATO ---
-    if len(colcap_data) == 1 and "count" in cc:
-        for item in colcap_data:
-            if isinstance(item, dict) and "date" in item and "value" in item:
-                date = item["date"]
-                combined.append(
-                    {
-                        "date": date,
-                        "news": cc["count"],  # usa el total de noticias encontradas
-                        "colcap": item["value"],
-                    }
-                )
-    else:
-        for item in colcap_data:
-            if isinstance(item, dict) and "date" in item and "value" in item:
-                date = item["date"]
-                combined.append(
-                    {
-                        "date": date,
-                        "news": news_by_date.get(date, 0),
-                        "colcap": item["value"],
-                    }
-                )
-
-    print("[Aggregator] Datos combinados:", combined)
-    response["combined"] = combined
 
+@app.route("/aggregate/jobs/<job_id>", methods=["GET"])
+def aggregate_job(job_id):
+    """
+    Poll a CommonCrawl job created by /aggregate?async=true and combine it
+    with COLCAP once it is done. Pass the same start, end and granularity as the
+    original request.
+    """
+    start = request.args.get("start")
+    end = request.args.get("end")
+    try:
+        options = analytics_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    response = query_upstreams(lambda: fetch_commoncrawl_job(job_id), start, end, options["granularity"])
+    job = response["commoncrawl"]
+    if response["status"]["commoncrawl"] == "ok":
+        if job.get("status") == "done":
+            response["commoncrawl"] = job["result"]
+            response["status"]["commoncrawl"] = commoncrawl_status(job["result"])
+        else:
+            response["status"]["commoncrawl"] = "error" if job.get("status") == "failed" else "pending"
+            response["commoncrawl"] = {
+                "job_id": job_id,
+                "status": job.get("status"),
+                "progress": job.get("progress"),
+                "error": job.get("error"),
+            }
+    response.update(combine(response, options))
     return jsonify(response)
 
 
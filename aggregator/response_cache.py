@@ -0,0 +1,145 @@
+"""
+Response cache for /aggregate with single-flight request coalescing.
+
+Responses are stored as JSON under a normalized key, either in process
+(MemoryBackend, bounded by bytes with LRU eviction) or in a Redis-compatible
+server (RedisBackend) so hits are shared across replicas. Concurrent misses
+for the same key within a process wait for one computation instead of each
+fanning out to the upstream services.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # optional dependency
+    redis = None
+
+log = logging.getLogger("response_cache")
+
+
+def normalize_key(term, keyword, index, start, end, granularity="month") -> str:
+    """Stable cache key for an /aggregate request."""
+    indices = sorted(i.strip() for i in (index or "").split(",") if i.strip())
+    parts = [
+        (term or "").strip().lower(),
+        (keyword or "").strip().lower(),
+        ",".join(indices),
+        (start or "").strip(),
+        (end or "").strip(),
+        granularity,
+    ]
+    return "aggregate:" + hashlib.sha1(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, payload = item
+            if expires < time.monotonic():
+                self._drop(key)
+                return None
+            self._items.move_to_end(key)
+            return payload
+
+    def set(self, key: str, payload: bytes, ttl: float) -> None:
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._drop(key)
+            self._items[key] = (time.monotonic() + ttl, payload)
+            self._size += len(payload)
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._items)))
+
+    def _drop(self, key: str) -> None:
+        _, payload = self._items.pop(key)
+        self._size -= len(payload)
+
+
+class RedisBackend:
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("RESPONSE_CACHE_URL requires the redis package")
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> bytes | None:
+        return self._client.get(key)
+
+    def set(self, key: str, payload: bytes, ttl: float) -> None:
+        self._client.set(key, payload, ex=max(1, int(ttl)))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, key: str):
+        try:
+            payload = self.backend.get(key)
+        except Exception as e:
+            log.error("Error leyendo caché: %s", e)
+            return None
+        return json.loads(payload) if payload is not None else None
+
+    def get_or_compute(self, key: str, compute, cacheable=lambda result: True):
+        """
+        Return (result, source) where source is "hit", "miss" or "shared".
+        Only results accepted by `cacheable` are stored.
+        """
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached, "hit"
+
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._inflight[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, "shared"
+
+        try:
+            call.result = compute()
+            if cacheable(call.result):
+                try:
+                    self.backend.set(key, json.dumps(call.result).encode("utf-8"), self.ttl)
+                except Exception as e:
+                    log.error("Error escribiendo caché: %s", e)
+            return call.result, "miss"
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.done.set()
@@ -0,0 +1,145 @@
+"""
+Columnar join of the CommonCrawl counts with the COLCAP series.
+
+Both series are put on a DatetimeIndex, resampled to a common frequency
+(news are summed, COLCAP keeps the last close of each period) and
+outer-joined on the period start, so rows match whatever date labels each
+service used. Derived series are computed on the joined frame:
+
+- colcap_return: period-over-period change of the close
+- news_change: period-over-period change of the article count
+- rolling_corr: correlation of news and colcap_return over `window` periods
+- lag_correlation: correlation of the news at t-lag with colcap_return at t
+
+Every correlation needs at least `window` paired points; with fewer it is None.
+"""
+import math
+import warnings
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+FREQUENCIES = {
+    "day": "D",
+    "week": "W-MON",
+    "month": "MS",
+}
+
+# Timeframe de colcap-fetcher para cada granularidad
+TIMEFRAMES = {
+    "day": "daily",
+    "week": "weekly",
+    "month": "monthly",
+}
+
+DATE_FORMATS = ("%Y-%m-%d", "%b %d, %Y", "%d.%m.%Y", "%d/%m/%Y")
+
+
+def parse_dates(values) -> pd.DatetimeIndex:
+    """Vectorized parse of the date labels of either service; unknown formats become NaT."""
+    raw = pd.Series(list(values), dtype=object).astype(str).str.strip()
+    parsed = pd.Series(pd.NaT, index=raw.index, dtype="datetime64[ns]")
+    for fmt in DATE_FORMATS:
+        missing = parsed.isna()
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(raw[missing], format=fmt, errors="coerce")
+    return pd.DatetimeIndex(parsed)
+
+
+def news_series(cc: dict) -> pd.Series | None:
+    """Article counts per histogram bucket, or None when the worker sent no histogram."""
+    buckets = cc.get("date_ranges_counts") if isinstance(cc, dict) else None
+    if not buckets:
+        return None
+    labels, counts = zip(*buckets)
+    series = pd.Series(counts, index=parse_dates(labels), dtype="float64")
+    return series[series.index.notna()].sort_index()
+
+
+def colcap_series(colcap) -> pd.Series:
+    """COLCAP closes from the colcap-fetcher payload (dict with "data" or a bare list)."""
+    if isinstance(colcap, dict):
+        colcap = colcap.get("data", [])
+    rows = [item for item in colcap or [] if isinstance(item, dict) and "date" in item and "value" in item]
+    if not rows:
+        return pd.Series(dtype="float64", index=pd.DatetimeIndex([]))
+    values = pd.to_numeric(pd.Series([item["value"] for item in rows]), errors="coerce").to_numpy("float64")
+    series = pd.Series(values, index=parse_dates(item["date"] for item in rows))
+    return series[series.index.notna()].sort_index()
+
+
+def _number(value) -> float | None:
+    return None if value is None or math.isnan(value) else float(value)
+
+
+@contextmanager
+def _quiet():
+    # Series cortas o constantes dan NaN (-> None); NumPy lo avisa con RuntimeWarning
+    with np.errstate(all="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        yield
+
+
+def join(news: pd.Series | None, colcap: pd.Series, granularity: str, window: int) -> pd.DataFrame:
+    """Resample both series to `granularity` and join them with the derived columns."""
+    freq = FREQUENCIES[granularity]
+    columns = {}
+    if news is not None and len(news):
+        columns["news"] = news.resample(freq, closed="left", label="left").sum()
+    if len(colcap):
+        columns["colcap"] = colcap.resample(freq, closed="left", label="left").last()
+    index = None if columns else pd.DatetimeIndex([])
+    # Los periodos vacíos dentro del histograma quedan en 0 al sumar; fuera de él, sin dato
+    frame = pd.DataFrame(columns, columns=["news", "colcap"], index=index, dtype="float64")
+
+    frame["colcap_return"] = frame["colcap"].pct_change(fill_method=None)
+    frame["news_change"] = frame["news"].pct_change(fill_method=None).where(lambda s: s.abs() != float("inf"))
+    frame["rolling_corr"] = frame["news"].rolling(window, min_periods=window).corr(frame["colcap_return"])
+    return frame
+
+
+def combine_series(cc: dict, colcap, granularity: str = "month", window: int = 3, max_lag: int = 3) -> dict:
+    """
+    Join the worker result with the COLCAP payload.
+    Returns {"combined": [row, ...], "analytics": {...}}; rows are chronological
+    and missing values are None. Without a histogram (count mode) every COLCAP
+    row carries the total news count, as before the columnar join.
+    """
+    news = news_series(cc)
+    with _quiet():
+        frame = join(news, colcap_series(colcap), granularity, window)
+        correlation = _number(frame["news"].corr(frame["colcap"], min_periods=window))
+        lag_correlation = [
+            {"lag": lag, "correlation": _number(
+                frame["news"].shift(lag).corr(frame["colcap_return"], min_periods=window)
+            )}
+            for lag in range(max_lag + 1)
+        ]
+
+    keys = ["date", *frame.columns]
+    data = [frame.index.strftime("%Y-%m-%d").tolist()]
+    for name in frame.columns:
+        data.append([_number(v) for v in frame[name].round(6).tolist()])
+    rows = [dict(zip(keys, values)) for values in zip(*data)]
+    for row in rows:
+        if row["news"] is not None:
+            row["news"] = int(row["news"])
+
+    analytics = {
+        "granularity": granularity,
+        "window": window,
+        "periods": len(frame),
+        "correlation": correlation,
+        "lag_correlation": lag_correlation,
+    }
+    if news is None and isinstance(cc, dict):
+        # Sin histograma (solo conteo): el total no se puede repartir por periodo; como antes,
+        # cada fila de COLCAP lleva el total en "news" (las series derivadas quedan en None)
+        total = cc.get("news_count", cc.get("count"))
+        analytics["news_total"] = total
+        for row in rows:
+            if row["colcap"] is not None:
+                row["news"] = total
+    return {"combined": rows, "analytics": analytics}
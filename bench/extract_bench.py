@@ -0,0 +1,125 @@
+"""
+Micro-benchmark: fast title/date extractor vs. the BeautifulSoup path.
+
+Runs both extractors of commoncrawl-worker over a corpus of saved
+El Espectador pages (*.html files) and reports per-page latency and how
+often the two agree.
+
+    python bench/extract_bench.py --corpus bench/pages
+    python bench/extract_bench.py --corpus bench/pages --fetch 200 --index CC-MAIN-2020-05
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "commoncrawl-worker"))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+import app  # noqa: E402
+
+
+def fetch_corpus(corpus: str, index: str, limit: int) -> None:
+    """Save up to `limit` HTML pages of the domain from one crawl into `corpus`."""
+    import gzip
+    from warcio.archiveiterator import ArchiveIterator
+
+    os.makedirs(corpus, exist_ok=True)
+    saved = 0
+    for line in app.iter_lines(app.cdx_chunks(index, app.cdx_url(index, page=0))):
+        if saved >= limit:
+            break
+        record = json.loads(line)
+        try:
+            payload = app.fetch_warc_range(record)
+        except app.UpstreamError:
+            continue
+        with gzip.GzipFile(fileobj=io.BytesIO(payload)) as gz:
+            for warc_record in ArchiveIterator(io.BytesIO(gz.read())):
+                if warc_record.rec_type == "response":
+                    path = os.path.join(corpus, f"{index}-{saved:05d}.html")
+                    with open(path, "wb") as f:
+                        f.write(warc_record.content_stream().read())
+                    saved += 1
+                    break
+    print(f"{saved} páginas guardadas en {corpus}")
+
+
+def soup_extract(html_content: str):
+    soup = BeautifulSoup(html_content, "html.parser")
+    title_tag = soup.find("title")
+    title = title_tag.get_text(strip=True) if title_tag else "No title"
+    return title, app.extract_date_from_soup(soup)
+
+
+def fast_extract(html_content: str):
+    title, date_news, _ = app.extract_article_fast(html_content)
+    return title, date_news
+
+
+def run(pages: list, extractor, repeat: int):
+    timings = []
+    results = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for html_content in pages:
+            best = float("inf")
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                result = extractor(html_content)
+                best = min(best, time.perf_counter() - t0)
+            timings.append(best)
+            results.append(result)
+    return timings, results
+
+
+def report(name: str, timings: list, size: int) -> None:
+    total = sum(timings)
+    print(
+        f"{name:>6}: {len(timings)} páginas, "
+        f"media {statistics.mean(timings) * 1000:.2f} ms, "
+        f"p95 {sorted(timings)[int(len(timings) * 0.95) - 1] * 1000:.2f} ms, "
+        f"{size / total / 1e6:.1f} MB/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--corpus", default=os.path.join(os.path.dirname(__file__), "pages"))
+    parser.add_argument("--fetch", type=int, default=0, help="download N pages into the corpus first")
+    parser.add_argument("--index", default="CC-MAIN-2020-05")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.fetch:
+        fetch_corpus(args.corpus, args.index, args.fetch)
+
+    files = sorted(f for f in os.listdir(args.corpus) if f.endswith(".html"))
+    if not files:
+        sys.exit(f"No hay páginas .html en {args.corpus}; use --fetch para descargarlas")
+    pages = []
+    for name in files:
+        with open(os.path.join(args.corpus, name), "rb") as f:
+            pages.append(f.read().decode("utf-8", errors="ignore"))
+    size = sum(len(p) for p in pages)
+
+    soup_t, soup_r = run(pages, soup_extract, args.repeat)
+    fast_t, fast_r = run(pages, fast_extract, args.repeat)
+    report("soup", soup_t, size)
+    report("fast", fast_t, size)
+    print(f"speedup: {sum(soup_t) / sum(fast_t):.1f}x")
+
+    same_date = sum(1 for a, b in zip(soup_r, fast_r) if a[1] == b[1])
+    same_title = sum(1 for a, b in zip(soup_r, fast_r) if a[0] == b[0])
+    print(f"fechas iguales: {same_date}/{len(pages)}, títulos iguales: {same_title}/{len(pages)}")
+    for name, a, b in zip(files, soup_r, fast_r):
+        if a[1] != b[1]:
+            print(f"  {name}: soup={a[1]!r} fast={b[1]!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Load test: replay a JSONL traffic file against the services.
+
+Each traffic line is a request, e.g.
+
+    {"path": "/aggregate", "params": {"term": "colcap", "keyword": "dolar", "start": "2020-01-01", "end": "2020-06-30"}}
+
+With --spawn, the stand-in upstreams (bench/standin.py) and the three
+services are started locally, wired to each other, under gunicorn (or the
+Flask dev server with --server flask), and stopped at the end. Without it,
+--target must point at running services.
+
+    python bench/loadtest.py --spawn --concurrency 16 --requests 400
+    python bench/loadtest.py --target http://127.0.0.1:5002 --duration 60
+"""
+import argparse
+import itertools
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import standin
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SERVICES = {
+    "colcap-fetcher": 5101,
+    "commoncrawl-worker": 5103,
+    "aggregator": 5102,
+}
+
+
+def load_traffic(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def wait_ready(url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except (requests.ConnectionError, requests.Timeout):
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} no respondió en {timeout}s")
+
+
+def spawn(args, procs: list) -> str:
+    """Start the stand-in and the services, adding them to `procs`; returns the aggregator URL."""
+    server = standin.serve(args.standin_port, args.records, args.pages, args.latency, args.jitter, args.error_rate,
+                           args.fixtures, args.record, args.retry_after)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    upstream = f"http://127.0.0.1:{args.standin_port}"
+    data_dir = tempfile.mkdtemp(prefix="notibolsa-load-")
+    env = dict(
+        os.environ,
+        PYTHONUNBUFFERED="1",
+        CC_INDEX_SERVER=upstream,
+        CC_DATA_SERVER=upstream,
+        COLCAP_API_URL=f"{upstream}/api/financialdata/historical/49642",
+        COMMONCRAWL_SERVICE=f"http://127.0.0.1:{SERVICES['commoncrawl-worker']}/process",
+        COLCAP_SERVICE=f"http://127.0.0.1:{SERVICES['colcap-fetcher']}/colcap",
+        RESPONSE_CACHE_TTL=str(args.cache_ttl),
+        CDX_CACHE_DIR=os.path.join(data_dir, "cdx"),
+        ARTICLE_STORE_DIR=os.path.join(data_dir, "articles"),
+        ARTICLE_INDEX_DIR=os.path.join(data_dir, "index"),
+        JOB_STORE_DIR=os.path.join(data_dir, "jobs"),
+        COLCAP_STORE_DIR=os.path.join(data_dir, "colcap"),
+    )
+    if args.workers:
+        env["WEB_WORKERS"] = str(args.workers)
+    if args.threads:
+        env["WEB_THREADS"] = str(args.threads)
+    for name, port in SERVICES.items():
+        if args.server == "flask":
+            cmd = [sys.executable, "app.py"]
+        else:
+            cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"]
+        log = open(os.path.join(data_dir, f"{name}.log"), "wb")
+        procs.append(subprocess.Popen(cmd, cwd=os.path.join(ROOT, name), env=dict(env, PORT=str(port)),
+                                      stdout=log, stderr=subprocess.STDOUT))
+    for port in SERVICES.values():
+        wait_ready(f"http://127.0.0.1:{port}/")
+    print(f"Servicios en marcha ({args.server}), logs en {data_dir}")
+    return f"http://127.0.0.1:{SERVICES['aggregator']}"
+
+
+def stop(procs: list) -> None:
+    for proc in procs:
+        proc.send_signal(signal.SIGTERM)
+    for proc in procs:
+        try:
+            proc.wait(timeout=90)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def run(target: str, traffic: list, concurrency: int, total: int | None, duration: float | None, timeout: float) -> dict:
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    latencies = defaultdict(list)
+    statuses = Counter()
+    lock = threading.Lock()
+    source = itertools.cycle(traffic)
+    issued = itertools.count()
+    deadline = time.monotonic() + duration if duration else None
+
+    def worker():
+        while True:
+            with lock:
+                n = next(issued)
+                item = next(source)
+            if (total is not None and n >= total) or (deadline is not None and time.monotonic() >= deadline):
+                return
+            t0 = time.perf_counter()
+            try:
+                resp = session.get(target + item["path"], params=item.get("params"), timeout=timeout)
+                status = resp.status_code
+            except requests.RequestException as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - t0
+            with lock:
+                latencies[item["path"]].append(elapsed)
+                statuses[status] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall = time.perf_counter() - started
+    return {"wall": wall, "latencies": latencies, "statuses": statuses}
+
+
+def report(result: dict) -> None:
+    every = [t for ts in result["latencies"].values() for t in ts]
+    print(f"\n{len(every)} peticiones en {result['wall']:.1f}s -> {len(every) / result['wall']:.1f} req/s")
+    print("Códigos:", dict(result["statuses"]))
+    print(f"{'ruta':<24}{'n':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for path, ts in sorted(result["latencies"].items()) + [("(total)", every)]:
+        print(f"{path:<24}{len(ts):>7}{percentile(ts, .5) * 1e3:>10.1f}{percentile(ts, .9) * 1e3:>10.1f}"
+              f"{percentile(ts, .99) * 1e3:>10.1f}{max(ts, default=0) * 1e3:>10.1f}")
+    if every:
+        print(f"media {statistics.mean(every) * 1e3:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--traffic", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "traffic.jsonl"))
+    parser.add_argument("--target", default="http://127.0.0.1:5002")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, help="total requests (default: one pass over the traffic file)")
+    parser.add_argument("--duration", type=float, help="run for this many seconds instead")
+    parser.add_argument("--timeout", type=float, default=200)
+    parser.add_argument("--spawn", action="store_true", help="start the stand-in and the services locally")
+    parser.add_argument("--server", choices=("gunicorn", "flask"), default="gunicorn")
+    parser.add_argument("--workers", type=int, help="WEB_WORKERS for every service")
+    parser.add_argument("--threads", type=int, help="WEB_THREADS for every service")
+    parser.add_argument("--cache-ttl", type=float, default=0, help="RESPONSE_CACHE_TTL of the aggregator")
+    parser.add_argument("--standin-port", type=int, default=8900)
+    standin.add_arguments(parser)
+    args = parser.parse_args()
+
+    traffic = load_traffic(args.traffic)
+    total = args.requests if args.requests or args.duration else len(traffic)
+    procs = []
+    target = args.target
+    try:
+        if args.spawn:
+            target = spawn(args, procs)
+        report(run(target, traffic, args.concurrency, total, args.duration, args.timeout))
+    finally:
+        stop(procs)
+
+
+if __name__ == "__main__":
+    main()
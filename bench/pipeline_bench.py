@@ -0,0 +1,270 @@
+"""
+Offline pipeline benchmark.
+
+Starts the upstream stand-in (bench/standin.py) in-process, synthetic or
+replaying recorded responses with --fixtures, points the worker at it and
+measures each stage without touching the internet:
+
+  normalize_date          per call, over the dates found in the pages
+  extract_date_from_soup  per page (BeautifulSoup path)
+  extract_article_fast    per page
+  parse_warc_record       per WARC slice (gunzip + warcio + extraction)
+  cdx_page                latency per CDX page request, no cache
+  warc_range              latency per WARC range request
+  process_cold/warm       /process end-to-end with empty and with filled caches,
+                          plus the per-stage split reported by the worker's metrics
+  aggregate_cold/warm     /aggregate end-to-end through the three services (--aggregate)
+
+    python bench/pipeline_bench.py --latency 0.05
+    python bench/pipeline_bench.py --fixtures bench/fixtures --index CC-MAIN-2020-05 --keyword economia
+    python bench/pipeline_bench.py --output before.json && ... && python bench/pipeline_bench.py --compare before.json
+"""
+import argparse
+import gzip
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import standin
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def configure_worker(upstream: str) -> None:
+    """Environment for importing the worker against the stand-in, with fresh stores."""
+    data_dir = tempfile.mkdtemp(prefix="notibolsa-bench-")
+    os.environ.update(
+        CC_INDEX_SERVER=upstream,
+        CC_DATA_SERVER=upstream,
+        CDX_CACHE_DIR=os.path.join(data_dir, "cdx"),
+        ARTICLE_STORE_DIR=os.path.join(data_dir, "articles"),
+        ARTICLE_INDEX_DIR=os.path.join(data_dir, "index"),
+        JOB_STORE_DIR=os.path.join(data_dir, "jobs"),
+        LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+    )
+    os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    sys.path.insert(0, os.path.join(HERE, "..", "commoncrawl-worker"))
+
+
+def timed(fn, items, repeat: int = 1) -> list:
+    """Best-of-`repeat` duration of fn(item) for every item."""
+    timings = []
+    for item in items:
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn(item)
+            best = min(best, time.perf_counter() - t0)
+        timings.append(best)
+    return timings
+
+
+def summarize(timings: list, work: int | None = None) -> dict:
+    if not timings:
+        return {"n": 0}
+    ordered = sorted(timings)
+    total = sum(timings)
+    summary = {
+        "n": len(timings),
+        "total_s": total,
+        "per_s": len(timings) / total if total else float("inf"),
+        "mean_ms": statistics.mean(timings) * 1e3,
+        "p50_ms": ordered[len(ordered) // 2] * 1e3,
+        "p90_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))] * 1e3,
+        "max_ms": ordered[-1] * 1e3,
+    }
+    if work:
+        summary["mb_per_s"] = work / total / 1e6 if total else float("inf")
+    return summary
+
+
+def html_of(payload: bytes) -> str | None:
+    from warcio.archiveiterator import ArchiveIterator
+
+    with gzip.GzipFile(fileobj=io.BytesIO(payload)) as gz:
+        for record in ArchiveIterator(io.BytesIO(gz.read())):
+            if record.rec_type == "response":
+                return record.content_stream().read().decode("utf-8", errors="ignore")
+    return None
+
+
+def stage_samples(app, idx: str, keyword: str | None, limit: int) -> tuple[list, dict, list]:
+    """Fetch CDX pages and WARC slices of one crawl; returns (records, timings, payloads)."""
+    timings = {"cdx_page": [], "warc_range": []}
+    records = []
+    pages = int(app.cdx_page_info(idx).get("pages", 1))
+    for page in range(pages):
+        url = app.cdx_url(idx, keyword, page=page)
+        t0 = time.perf_counter()
+        resp = app.limited_get(url, timeout=30)
+        timings["cdx_page"].append(time.perf_counter() - t0)
+        if resp.status_code == 200:
+            records.extend(json.loads(line) for line in resp.text.splitlines() if line.strip())
+        if len(records) >= limit:
+            break
+    records = records[:limit]
+    payloads = []
+    for record in records:
+        t0 = time.perf_counter()
+        try:
+            payload = app.fetch_warc_range(record)
+        except app.UpstreamError:
+            continue
+        timings["warc_range"].append(time.perf_counter() - t0)
+        payloads.append(payload)
+    return records, timings, payloads
+
+
+def metric_sums(app) -> dict:
+    """Running sums of the worker's stage histograms, in seconds."""
+    from prometheus_client import REGISTRY
+
+    def value(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    methods = ("json-ld", "fusion", "soup", "none")
+    return {
+        "cdx_network": value("notibolsa_cdx_fetch_seconds_sum", source="network"),
+        "cdx_cache": value("notibolsa_cdx_fetch_seconds_sum", source="cache"),
+        "warc": value("notibolsa_warc_fetch_seconds_sum"),
+        "parse": sum(value("notibolsa_parse_seconds_sum", method=m) for m in methods),
+        "warc_requests": value("notibolsa_warc_fetch_seconds_count"),
+    }
+
+
+def bench_process(app, params: dict, repeat: int) -> tuple[dict, dict]:
+    before = metric_sums(app)
+    t0 = time.perf_counter()
+    result = app.run_query(dict(params))
+    cold = time.perf_counter() - t0
+    after = metric_sums(app)
+    split = {name: after[name] - before[name] for name in after}
+    split["matches"] = result.get("count", result.get("news_count"))
+    split["failures"] = result.get("failures", {}).get("count", 0)
+    warm = timed(lambda p: app.run_query(dict(p)), [params] * repeat)
+    return {"process_cold": summarize([cold]), "process_warm": summarize(warm)}, split
+
+
+def bench_aggregate(args, params: dict, repeat: int) -> dict:
+    import loadtest
+
+    spawn_args = argparse.Namespace(**vars(args))
+    spawn_args.standin_port = args.port + 1
+    spawn_args.server = "gunicorn"
+    spawn_args.workers = spawn_args.threads = None
+    spawn_args.cache_ttl = 0
+    procs = []
+    try:
+        target = loadtest.spawn(spawn_args, procs)
+        traffic = [{"path": "/aggregate", "params": params}]
+        cold = loadtest.run(target, traffic, 1, 1, None, 300)
+        warm = loadtest.run(target, traffic, 1, repeat, None, 300)
+    finally:
+        loadtest.stop(procs)
+    return {
+        "aggregate_cold": summarize(cold["latencies"]["/aggregate"]),
+        "aggregate_warm": summarize(warm["latencies"]["/aggregate"]),
+    }
+
+
+def report(results: dict, baseline: dict | None) -> None:
+    header = f"{'etapa':<24}{'n':>6}{'ops/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'max ms':>10}"
+    if baseline:
+        header += f"{'vs base':>10}"
+    print(header)
+    for name, s in results["stages"].items():
+        if not s.get("n"):
+            continue
+        line = f"{name:<24}{s['n']:>6}{s['per_s']:>10.1f}{s['p50_ms']:>10.2f}{s['p90_ms']:>10.2f}{s['max_ms']:>10.2f}"
+        base = (baseline or {}).get("stages", {}).get(name)
+        if base and base.get("n"):
+            line += f"{base['p50_ms'] / s['p50_ms']:>9.2f}x" if s["p50_ms"] else f"{'-':>10}"
+        print(line)
+    split = results.get("process_split")
+    if split:
+        print("\nprocess_cold por etapa (s, suma sobre hilos):",
+              ", ".join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in split.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default="CC-MAIN-2020-05")
+    parser.add_argument("--keyword", default="economia")
+    parser.add_argument("--start-date", default="2019-10-01")
+    parser.add_argument("--end-date", default="2020-02-29")
+    parser.add_argument("--samples", type=int, default=50, help="WARC records for the per-page stages")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--aggregate", action="store_true", help="also time /aggregate through gunicorn services")
+    parser.add_argument("--port", type=int, default=8910)
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare p50 against")
+    standin.add_arguments(parser)
+    args = parser.parse_args()
+
+    server = standin.serve(args.port, args.records, args.pages, args.latency, args.jitter, args.error_rate,
+                           args.fixtures, args.record, args.retry_after)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    configure_worker(f"http://127.0.0.1:{args.port}")
+    import app
+
+    stages = {}
+    records, fetch_timings, payloads = stage_samples(app, args.index, args.keyword, args.samples)
+    pages = [h for h in (html_of(p) for p in payloads) if h]
+    if not pages:
+        sys.exit("El stand-in no devolvió páginas; revise --fixtures/--index/--keyword")
+
+    from bs4 import BeautifulSoup
+
+    soup_t = timed(lambda h: app.extract_date_from_soup(BeautifulSoup(h, "html.parser")), pages, args.repeat)
+    fast_t = timed(app.extract_article_fast, pages, args.repeat)
+    parse_t = timed(app.parse_warc_record, payloads, args.repeat)
+    dates = [app.extract_article(h)[1] for h in pages]
+    raw_dates = [d for d in dates if d] + ["23/10/2020 13:45:00", "2020-11-23T23:09:52.631Z", "2020-11-23"]
+    norm_t = timed(app.normalize_date, raw_dates * 20)
+
+    size = sum(len(h) for h in pages)
+    stages["normalize_date"] = summarize(norm_t)
+    stages["extract_date_from_soup"] = summarize(soup_t, size)
+    stages["extract_article_fast"] = summarize(fast_t, size)
+    stages["parse_warc_record"] = summarize(parse_t, sum(len(p) for p in payloads))
+    stages["cdx_page"] = summarize(fetch_timings["cdx_page"])
+    stages["warc_range"] = summarize(fetch_timings["warc_range"], sum(len(p) for p in payloads))
+
+    params = {
+        "index": args.index,
+        "keyword": args.keyword,
+        "start_date": args.start_date,
+        "end_date": args.end_date,
+        "granularity": "month",
+        "source": "live",
+    }
+    process_stages, split = bench_process(app, params, args.repeat)
+    stages.update(process_stages)
+    if args.aggregate:
+        stages.update(bench_aggregate(args, {
+            "term": "colcap", "keyword": args.keyword, "index": args.index,
+            "start": args.start_date, "end": args.end_date,
+        }, args.repeat))
+
+    results = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "stages": stages,
+        "process_split": split,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
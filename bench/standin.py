@@ -0,0 +1,296 @@
+"""
+Local stand-in for the upstreams of the three services.
+
+Serves, on a single port, synthetic but well-formed answers for:
+
+  /<crawl>-index?...                 CDX server (showNumPages, page, ~url: filter)
+  /crawl-data/...                    gzipped WARC records (206 Partial Content)
+  /api/financialdata/historical/...  investing.com COLCAP history
+
+With --fixtures DIR it replays recorded upstream responses instead (and
+with --record it fills DIR by forwarding misses to the real upstreams once).
+Every response is delayed by --latency seconds (plus up to --jitter) and a
+--error-rate fraction answers 503 (with Retry-After when --retry-after is
+set), so the services can be load-tested and
+benchmarked without touching the internet. Point them at it with
+
+    CC_INDEX_SERVER=http://127.0.0.1:8900
+    CC_DATA_SERVER=http://127.0.0.1:8900
+    COLCAP_API_URL=http://127.0.0.1:8900/api/financialdata/historical/49642
+
+    python bench/standin.py --port 8900 --latency 0.05
+    python bench/standin.py --fixtures bench/fixtures --record    # grabar una vez
+    python bench/standin.py --fixtures bench/fixtures             # reproducir
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+UPSTREAMS = {
+    "index": "https://index.commoncrawl.org",
+    "data": "https://data.commoncrawl.org",
+    "colcap": "https://api.investing.com",
+}
+
+SECTIONS = ["economia", "politica", "judicial", "deportes", "entretenimiento", "mundo", "bogota", "opinion"]
+TOPICS = ["dolar", "petroleo", "bolsa", "inflacion", "elecciones", "paro", "covid", "futbol", "reforma", "tasas"]
+_CRAWL_RE = re.compile(r"CC-MAIN-(\d{4})-(\d{2})")
+
+
+def crawl_date(idx: str) -> date:
+    """Approximate crawl date from a CC-MAIN-YYYY-WW id."""
+    m = _CRAWL_RE.search(idx)
+    if not m:
+        return date(2020, 1, 1)
+    year, week = int(m.group(1)), max(1, min(int(m.group(2)), 52))
+    return date.fromisocalendar(year, week, 1)
+
+
+class Corpus:
+    """Deterministic synthetic CDX records and pages for any crawl id."""
+
+    def __init__(self, records: int, pages: int):
+        self.records = records
+        self.pages = pages
+
+    def record(self, idx: str, i: int) -> dict:
+        rnd = random.Random(f"{idx}/{i}")
+        section = rnd.choice(SECTIONS)
+        slug = "-".join(rnd.sample(TOPICS, 2))
+        return {
+            "url": f"https://www.elespectador.com/{section}/{slug}-{i}/",
+            "filename": f"crawl-data/{idx}/segments/{i}.warc.gz",
+            "offset": "0",
+            "length": "4096",
+            "status": "200",
+            "mime": "text/html",
+        }
+
+    def page_lines(self, idx: str, page: int, needle: str | None, fields: list | None) -> list:
+        per_page = -(-self.records // self.pages)
+        lines = []
+        for i in range(page * per_page, min(self.records, (page + 1) * per_page)):
+            record = self.record(idx, i)
+            if needle and needle not in record["url"]:
+                continue
+            if fields:
+                record = {k: record[k] for k in fields if k in record}
+            lines.append(json.dumps(record))
+        return lines
+
+    def warc(self, idx: str, i: int) -> bytes:
+        rnd = random.Random(f"{idx}/{i}/page")
+        record = self.record(idx, i)
+        published = crawl_date(idx) - timedelta(days=rnd.randrange(90), minutes=rnd.randrange(1440))
+        ld = {"@type": "NewsArticle", "datePublished": published.strftime("%Y-%m-%dT%H:%M:%S.000Z")}
+        body = (
+            f"<html><head><title>{record['url'].split('/')[-2]} | EL ESPECTADOR</title>"
+            f'<script type="application/ld+json">{json.dumps(ld)}</script></head>'
+            f"<body>{'<p>texto de la noticia</p>' * 200}</body></html>"
+        ).encode("utf-8")
+        buf = BytesIO()
+        writer = WARCWriter(buf, gzip=True)
+        headers = StatusAndHeaders("200 OK", [("Content-Type", "text/html; charset=utf-8")], protocol="HTTP/1.1")
+        writer.write_record(writer.create_warc_record(record["url"], "response", payload=BytesIO(body), http_headers=headers))
+        return buf.getvalue()
+
+
+def colcap_rows(start: date, end: date, timeframe: str) -> list:
+    rows = []
+    day = end
+    while day >= start:
+        value = 1000 + (day.toordinal() % 365) * 1.5
+        rows.append({
+            "rowDate": day.strftime("%b %d, %Y"),
+            "rowDateTimestamp": f"{day.isoformat()}T00:00:00Z",
+            "last_close": f"{value:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."),
+        })
+        if timeframe == "Monthly":
+            day = (day.replace(day=1) - timedelta(days=1)).replace(day=1)
+        elif timeframe == "Weekly":
+            day -= timedelta(days=7)
+        else:
+            day -= timedelta(days=1)
+    return rows
+
+
+def upstream_for(path: str) -> str:
+    if path.startswith("/crawl-data/"):
+        return UPSTREAMS["data"]
+    if path.startswith("/api/"):
+        return UPSTREAMS["colcap"]
+    return UPSTREAMS["index"]
+
+
+class Fixtures:
+    """
+    Recorded upstream responses, one file per (path with query, Range header).
+    Each entry is <key>.bin with the body and <key>.json with status and content type.
+    """
+
+    def __init__(self, directory: str, record: bool):
+        self.directory = directory
+        self.record = record
+        self._session = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.{ext}")
+
+    @staticmethod
+    def key(path: str, byte_range: str | None) -> str:
+        return hashlib.sha1(f"{path}|{byte_range or ''}".encode("utf-8")).hexdigest()
+
+    def get(self, path: str, byte_range: str | None):
+        """Return (status, content_type, body), recording it first if needed; None if missing."""
+        key = self.key(path, byte_range)
+        try:
+            with open(self._path(key, "json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(self._path(key, "bin"), "rb") as f:
+                return meta["status"], meta["content_type"], f.read()
+        except FileNotFoundError:
+            if not self.record:
+                return None
+        return self._record(key, path, byte_range)
+
+    def _record(self, key: str, path: str, byte_range: str | None):
+        if self._session is None:
+            try:
+                import cloudscraper
+                self._session = cloudscraper.create_scraper()
+            except ImportError:
+                self._session = requests.Session()
+        headers = {"Range": byte_range} if byte_range else {}
+        if path.startswith("/api/"):
+            headers.update({"Domain-id": "es", "Origin": "https://es.investing.com", "Referer": "https://es.investing.com/"})
+        resp = self._session.get(upstream_for(path) + path, headers=headers, timeout=60)
+        entry = (resp.status_code, resp.headers.get("Content-Type", "application/octet-stream"), resp.content)
+        if resp.status_code in (200, 206, 404):
+            os.makedirs(os.path.dirname(self._path(key, "bin")), exist_ok=True)
+            with open(self._path(key, "bin"), "wb") as f:
+                f.write(entry[2])
+            with open(self._path(key, "json"), "w", encoding="utf-8") as f:
+                json.dump({"path": path, "range": byte_range, "status": entry[0], "content_type": entry[1]}, f)
+        return entry
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    corpus: Corpus
+    fixtures: Fixtures | None = None
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+    retry_after = None
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def send(self, status: int, body: bytes, content_type: str = "application/json", headers: dict | None = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        time.sleep(self.latency + random.random() * self.jitter)
+        if random.random() < self.error_rate:
+            headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else None
+            return self.send(503, b"Slow Down", "text/plain", headers)
+        if self.fixtures is not None:
+            entry = self.fixtures.get(self.path, self.headers.get("Range"))
+            if entry is None:
+                return self.send(404, b"not recorded", "text/plain")
+            status, content_type, body = entry
+            return self.send(status, body, content_type)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.endswith("-index"):
+            return self.cdx(url.path.strip("/")[: -len("-index")], query)
+        if url.path.startswith("/crawl-data/"):
+            idx, _, name = url.path[len("/crawl-data/"):].partition("/segments/")
+            return self.send(206, self.corpus.warc(idx, int(name.split(".")[0])), "application/octet-stream")
+        if url.path.startswith("/api/financialdata/historical/"):
+            start = date.fromisoformat(query["start-date"][0])
+            end = date.fromisoformat(query["end-date"][0])
+            rows = colcap_rows(start, end, query.get("time-frame", ["Monthly"])[0])
+            return self.send(200, json.dumps({"data": rows}).encode("utf-8"))
+        self.send(404, b"not found", "text/plain")
+
+    def cdx(self, idx: str, query: dict):
+        if query.get("showNumPages"):
+            info = {"pages": self.corpus.pages, "pageSize": 5, "blocks": self.corpus.pages * 5}
+            return self.send(200, json.dumps(info).encode("utf-8"))
+        needle = None
+        for f in query.get("filter", []):
+            if f.startswith("~url:"):
+                needle = f[len("~url:"):]
+        fields = query["fl"][0].split(",") if "fl" in query else None
+        page = int(query.get("page", ["0"])[0])
+        lines = self.corpus.page_lines(idx, page, needle, fields)
+        if not lines:
+            return self.send(404, b"No Captures found", "text/plain")
+        self.send(200, ("\n".join(lines) + "\n").encode("utf-8"), "text/x-ndjson")
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Los clientes cortan conexiones keep-alive al terminar; no es un error del stand-in
+        pass
+
+
+def serve(port: int, records: int, pages: int, latency: float, jitter: float, error_rate: float,
+          fixtures: str | None = None, record: bool = False, retry_after: float | None = None) -> ThreadingHTTPServer:
+    handler = type("StandinHandler", (Handler,), {
+        "corpus": Corpus(records, pages),
+        "fixtures": Fixtures(fixtures, record) if fixtures else None,
+        "latency": latency,
+        "jitter": jitter,
+        "error_rate": error_rate,
+        "retry_after": retry_after,
+    })
+    return Server(("127.0.0.1", port), handler)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--records", type=int, default=600, help="CDX records per crawl")
+    parser.add_argument("--pages", type=int, default=3, help="CDX pages per crawl")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.02, help="random extra seconds, up to")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 503 answers")
+    parser.add_argument("--retry-after", type=float, help="Retry-After seconds sent with the 503 answers")
+    parser.add_argument("--fixtures", help="replay recorded responses from this directory instead of synthetic ones")
+    parser.add_argument("--record", action="store_true", help="with --fixtures, fetch and save missing responses from the real upstreams")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = serve(args.port, args.records, args.pages, args.latency, args.jitter, args.error_rate,
+                   args.fixtures, args.record, args.retry_after)
+    print(f"Stand-in escuchando en http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,174 @@
 import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
 
 import cloudscraper
 from flask import Flask, jsonify, request
+from prometheus_client import Counter, Histogram
+
+from series_store import SeriesStore
+from telemetry import instrument, setup_logging, span
+
+setup_logging("colcap-fetcher")
+log = logging.getLogger("colcap")
 
 app = Flask(__name__)
+instrument(app)
+
+UPSTREAM_SECONDS = Histogram(
+    "notibolsa_investing_seconds", "Latency of investing.com history requests", ["status"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+CACHE_LOOKUPS = Counter("notibolsa_cache_lookups", "Cache lookups by cache and result", ["cache", "result"])
+
+# Reintentos cuando investing.com rechaza la sesión (desafío de Cloudflare vencido)
+SCRAPER_RETRIES = int(os.getenv("SCRAPER_RETRIES", 1))
+SCRAPER_BACKOFF = float(os.getenv("SCRAPER_BACKOFF", 1.0))
+RETRY_STATUSES = (403, 429, 503)
+
+_scraper = None
+_scraper_lock = threading.Lock()
+
+
+def get_scraper(refresh: bool = False):
+    """
+    Return the shared cloudscraper session, creating it on first use.
+    Reusing it keeps the Cloudflare clearance cookies and the keep-alive
+    connections to investing.com across requests.
+    """
+    global _scraper
+    with _scraper_lock:
+        if _scraper is None or refresh:
+            _scraper = cloudscraper.create_scraper(
+                browser={"browser": "chrome", "platform": "windows", "mobile": False}
+            )
+        return _scraper
+
+
+def scraper_get(url: str, headers: dict):
+    """GET through the shared scraper, starting a fresh session when it gets blocked."""
+    response = get_scraper().get(url, headers=headers, timeout=60)
+    for attempt in range(SCRAPER_RETRIES):
+        if response.status_code not in RETRY_STATUSES:
+            break
+        time.sleep(SCRAPER_BACKOFF * (2 ** attempt))
+        response = get_scraper(refresh=True).get(url, headers=headers, timeout=60)
+    return response
+
+
+# Serie local de COLCAP: solo se piden a investing.com los tramos que faltan
+COLCAP_STORE_DIR = os.getenv("COLCAP_STORE_DIR", os.path.join(tempfile.gettempdir(), "notibolsa-colcap"))
+series_store = SeriesStore(COLCAP_STORE_DIR) if COLCAP_STORE_DIR else None
+
+TIMEFRAMES = {
+    "daily": "Daily",
+    "weekly": "Weekly",
+    "monthly": "Monthly",
+}
+
+HEADERS = {
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Language": "es-419,es;q=0.9",
+    "Domain-id": "es",
+    "Origin": "https://es.investing.com",
+    "Referer": "https://es.investing.com/",
+}
+
+# API de investing.com (configurable para apuntar a réplicas locales en pruebas de carga)
+COLCAP_API_URL = os.getenv("COLCAP_API_URL", "https://api.investing.com/api/financialdata/historical/49642")
+
+ROW_DATE_FORMATS = ("%b %d, %Y", "%d.%m.%Y", "%d/%m/%Y", "%Y-%m-%d")
+
+
+class UpstreamError(Exception):
+    pass
+
+
+def period_start(day: date, timeframe: str) -> date:
+    """First day of the daily/weekly/monthly period that contains `day`."""
+    if timeframe == "monthly":
+        return day.replace(day=1)
+    if timeframe == "weekly":
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def parse_row_date(item: dict) -> date | None:
+    """Normalize an investing.com row to its calendar date."""
+    stamp = item.get("rowDateTimestamp")
+    if stamp:
+        try:
+            return date.fromisoformat(str(stamp)[:10])
+        except ValueError:
+            pass
+    for fmt in ROW_DATE_FORMATS:
+        try:
+            return datetime.strptime(str(item.get("rowDate", "")), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def fetch_rows(start: date, end: date, timeframe: str) -> list:
+    """
+    Fetch [start, end] from investing.com.
+    Returns (date, row_date, value) tuples; date is None when it could not be parsed.
+    """
+    url = (
+        f"{COLCAP_API_URL}?start-date={start.isoformat()}&end-date={end.isoformat()}"
+        f"&time-frame={TIMEFRAMES[timeframe]}&add-missing-rows=false"
+    )
+    started = time.perf_counter()
+    with span("GET investing.com", timeframe=timeframe):
+        response = scraper_get(url, HEADERS)
+    UPSTREAM_SECONDS.labels(str(response.status_code)).observe(time.perf_counter() - started)
+    if response.status_code != 200:
+        raise UpstreamError(f"investing.com respondió {response.status_code}")
+    datos = json.loads(response.text)
+    rows = []
+    for item in datos.get("data", []):
+        # Convertir el valor a float, reemplazando separadores de miles y decimales
+        valor = str(item["last_close"]).replace(".", "").replace(",", ".")
+        try:
+            valor = float(valor)
+        except Exception:
+            valor = None
+        rows.append((parse_row_date(item), item["rowDate"], valor))
+    return rows
+
+
+def load_series(start: date, end: date, timeframe: str) -> list:
+    """
+    Return (row_date, value) rows for [start, end], newest first.
+    Only the sub-ranges missing from the store are fetched upstream. Periods
+    from the current one onwards are always fetched again because their
+    close can still change.
+    """
+    if series_store is None:
+        return [(row_date, value) for _, row_date, value in fetch_rows(start, end, timeframe)]
+
+    closed_until = period_start(date.today(), timeframe) - timedelta(days=1)
+    gaps = series_store.missing(timeframe, start, min(end, closed_until))
+    CACHE_LOOKUPS.labels("colcap_store", "miss" if gaps else "hit").inc()
+    if end > closed_until:
+        current = (max(start, closed_until + timedelta(days=1)), end)
+        if gaps and gaps[-1][1] + timedelta(days=1) == current[0]:
+            gaps[-1] = (gaps[-1][0], end)
+        else:
+            gaps.append(current)
+    for gap_start, gap_end in gaps:
+        rows = fetch_rows(gap_start, gap_end, timeframe)
+        parsed = [row for row in rows if row[0] is not None]
+        covered = (gap_start, min(gap_end, closed_until))
+        # Si alguna fila no tiene fecha reconocible no se puede marcar el tramo como completo
+        series_store.save(timeframe, parsed, covered if len(parsed) == len(rows) else None)
+        if len(parsed) != len(rows):
+            log.warning("Filas sin fecha reconocible en %s..%s", gap_start, gap_end)
+    return [(row_date, value) for _, row_date, value in series_store.rows(timeframe, start, end)]
 
 
 @app.route("/colcap", methods=["GET"])
@@ -12,39 +177,25 @@ def get_colcap():
     end_date = request.args.get("end")
     if not start_date or not end_date:
         return jsonify({"error": "Missing date parameters"}), 400
+    timeframe = request.args.get("timeframe", "monthly").lower()
+    if timeframe not in TIMEFRAMES:
+        return jsonify({"error": f"timeframe must be one of {', '.join(TIMEFRAMES)}"}), 400
+    try:
+        start = period_start(date.fromisoformat(start_date), timeframe)
+        end = date.fromisoformat(end_date)
+    except ValueError:
+        return jsonify({"error": "Dates must be YYYY-MM-DD"}), 400
 
-    url = f"https://api.investing.com/api/financialdata/historical/49642?start-date={start_date}&end-date={end_date}&time-frame=Monthly&add-missing-rows=false"
-    headers = {
-        "Accept": "application/json, text/plain, */*",
-        "Accept-Language": "es-419,es;q=0.9",
-        "Domain-id": "es",
-        "Origin": "https://es.investing.com",
-        "Referer": "https://es.investing.com/",
-    }
-    scraper = cloudscraper.create_scraper(
-        browser={"browser": "chrome", "platform": "windows", "mobile": False}
-    )
     try:
-        response = scraper.get(url, headers=headers)
-        if response.status_code != 200:
-            return jsonify({"error": "Failed to fetch data"}), 500
-        datos = json.loads(response.text)
-        result = []
-        for item in datos.get("data", []):
-            # Convertir el valor a float, reemplazando separadores de miles y decimales
-            valor = str(item["last_close"]).replace(".", "").replace(",", ".")
-            try:
-                valor = float(valor)
-            except Exception:
-                valor = None
-            result.append({"date": item["rowDate"], "value": valor})
-        return jsonify({"ticker": "COLCAP", "count": len(result), "data": result}), 200
+        rows = load_series(start, end, timeframe)
+    except UpstreamError:
+        return jsonify({"error": "Failed to fetch data"}), 500
     except Exception as e:
         return jsonify({"error": "Internal server error", "detail": str(e)}), 500
+    result = [{"date": row_date, "value": value} for row_date, value in rows]
+    return jsonify({"ticker": "COLCAP", "timeframe": timeframe, "count": len(result), "data": result}), 200
 
 
 if __name__ == "__main__":
-    import os
-
     port = int(os.getenv("PORT", 5001))
     app.run(host="0.0.0.0", port=port)
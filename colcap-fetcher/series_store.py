@@ -0,0 +1,104 @@
+"""
+Local time-series store for COLCAP rows.
+
+Rows are kept in SQLite keyed by (timeframe, ISO date) together with the
+original rowDate string. A coverage table records which date ranges have
+already been fetched for each timeframe, so a request only needs to go
+upstream for the sub-ranges that are still missing.
+"""
+import os
+import sqlite3
+import threading
+from datetime import date, timedelta
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    timeframe TEXT NOT NULL,
+    date TEXT NOT NULL,
+    row_date TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (timeframe, date)
+);
+CREATE TABLE IF NOT EXISTS coverage (
+    timeframe TEXT NOT NULL,
+    start TEXT NOT NULL,
+    end TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS coverage_timeframe ON coverage (timeframe, start);
+"""
+
+ONE_DAY = timedelta(days=1)
+
+
+class SeriesStore:
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "colcap.sqlite3")
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def rows(self, timeframe: str, start: date, end: date) -> list:
+        """Stored (date, row_date, value) rows in [start, end], newest first."""
+        return self._conn().execute(
+            "SELECT date, row_date, value FROM rows WHERE timeframe = ? AND date BETWEEN ? AND ? "
+            "ORDER BY date DESC",
+            (timeframe, start.isoformat(), end.isoformat()),
+        ).fetchall()
+
+    def _coverage(self, timeframe: str) -> list:
+        rows = self._conn().execute(
+            "SELECT start, end FROM coverage WHERE timeframe = ? ORDER BY start", (timeframe,)
+        ).fetchall()
+        return [(date.fromisoformat(s), date.fromisoformat(e)) for s, e in rows]
+
+    def missing(self, timeframe: str, start: date, end: date) -> list:
+        """Sub-ranges of [start, end] (inclusive) that have not been fetched yet."""
+        gaps = []
+        cursor = start
+        for cov_start, cov_end in self._coverage(timeframe):
+            if cov_end < cursor:
+                continue
+            if cov_start > end:
+                break
+            if cov_start > cursor:
+                gaps.append((cursor, cov_start - ONE_DAY))
+            cursor = max(cursor, cov_end + ONE_DAY)
+        if cursor <= end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def save(self, timeframe: str, rows: list, covered: tuple | None) -> None:
+        """
+        Upsert (date, row_date, value) rows and mark `covered` (start, end) as fetched.
+        Pass covered=None for ranges that may still change upstream.
+        """
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO rows (timeframe, date, row_date, value) VALUES (?, ?, ?, ?)",
+                    [(timeframe, d.isoformat(), row_date, value) for d, row_date, value in rows],
+                )
+                if covered is None or covered[0] > covered[1]:
+                    return
+                merged = []
+                for cov_start, cov_end in sorted(self._coverage(timeframe) + [covered]):
+                    if merged and cov_start <= merged[-1][1] + ONE_DAY:
+                        merged[-1] = (merged[-1][0], max(merged[-1][1], cov_end))
+                    else:
+                        merged.append((cov_start, cov_end))
+                conn.execute("DELETE FROM coverage WHERE timeframe = ?", (timeframe,))
+                conn.executemany(
+                    "INSERT INTO coverage (timeframe, start, end) VALUES (?, ?, ?)",
+                    [(timeframe, s.isoformat(), e.isoformat()) for s, e in merged],
+                )
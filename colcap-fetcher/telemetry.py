@@ -0,0 +1,172 @@
+"""
+Logging, metrics and tracing for the NotiBolsa services.
+
+Each service image only contains its own directory, so this module is
+duplicated (unchanged) in commoncrawl-worker, aggregator and colcap-fetcher.
+
+- Logging: one line per record on stderr, JSON by default (LOG_FORMAT=text
+  for development), filtered by LOG_LEVEL. Use %-style arguments so
+  disabled levels cost nothing, and extra={"fields": {...}} for structured data.
+- Metrics: prometheus_client, exposed on /metrics. Under gunicorn the
+  config sets PROMETHEUS_MULTIPROC_DIR so every worker process is aggregated.
+- Tracing: a W3C traceparent header starts (or continues) a trace; each
+  span() is logged with its duration, trace and parent ids. Requests without
+  the header are traced with probability TRACE_SAMPLE_RATE.
+"""
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json | text
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0))
+
+TraceContext = namedtuple("TraceContext", "trace_id span_id")
+_trace = contextvars.ContextVar("trace", default=None)
+_service = "notibolsa"
+
+log = logging.getLogger("telemetry")
+
+REQUEST_SECONDS = Histogram(
+    "notibolsa_http_request_seconds",
+    "Time to first byte of HTTP responses",
+    ["route", "method", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 180),
+)
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "service": _service,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        ctx = _trace.get()
+        if ctx is not None:
+            entry["trace_id"] = ctx.trace_id
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(service: str) -> None:
+    """Route every logger of the process to stderr in the configured format."""
+    global _service
+    _service = service
+    handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+    logging.getLogger("urllib3").setLevel(max(logging.WARNING, root.level))
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def parse_traceparent(header: str | None) -> TraceContext | None:
+    parts = (header or "").split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return TraceContext(parts[1], parts[2])
+
+
+def trace_headers() -> dict:
+    """Headers that continue the current trace in a downstream service."""
+    ctx = _trace.get()
+    if ctx is None:
+        return {}
+    return {"traceparent": f"00-{ctx.trace_id}-{ctx.span_id}-01"}
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block as a child span of the current trace; a no-op when not tracing."""
+    parent = _trace.get()
+    if parent is None:
+        yield
+        return
+    ctx = TraceContext(parent.trace_id, _new_id(64))
+    token = _trace.set(ctx)
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = repr(e)
+        raise
+    finally:
+        _trace.reset(token)
+        fields = {"span": name, "span_id": ctx.span_id, "parent_id": parent.span_id,
+                  "trace_id": ctx.trace_id, "duration_ms": round((time.perf_counter() - started) * 1e3, 2)}
+        fields.update(attrs)
+        if error is not None:
+            fields["error"] = error
+        log.info("span %s", name, extra={"fields": fields})
+
+
+def metrics_response() -> Response:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def instrument(app) -> None:
+    """Add request metrics, trace propagation and the /metrics route to a Flask app."""
+
+    @app.before_request
+    def start_request():
+        g.started = time.perf_counter()
+        ctx = parse_traceparent(request.headers.get("traceparent"))
+        if ctx is None and TRACE_SAMPLE_RATE and random.random() < TRACE_SAMPLE_RATE:
+            ctx = TraceContext(_new_id(128), _new_id(64))
+        g.parent_span = ctx.span_id if ctx is not None else None
+        if ctx is not None:
+            ctx = TraceContext(ctx.trace_id, _new_id(64))
+        _trace.set(ctx)
+
+    @app.after_request
+    def finish_request(response):
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        if route == "/metrics":
+            return response
+        elapsed = time.perf_counter() - g.get("started", time.perf_counter())
+        REQUEST_SECONDS.labels(route, request.method, str(response.status_code)).observe(elapsed)
+        ctx = _trace.get()
+        if ctx is not None:
+            response.headers["X-Trace-Id"] = ctx.trace_id
+            log.info("span %s", route, extra={"fields": {
+                "span": f"{request.method} {route}", "span_id": ctx.span_id, "parent_id": g.parent_span,
+                "trace_id": ctx.trace_id, "status": response.status_code,
+                "duration_ms": round(elapsed * 1e3, 2),
+            }})
+        return response
+
+    app.add_url_rule("/metrics", "metrics", metrics_response)
@@ -1,23 +1,82 @@
 import gzip
+import html
+import contextvars
 import json
-from datetime import datetime
+import logging
+import os
+import queue
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 from io import BytesIO
+from urllib.parse import urlencode, urlparse
 
+import pandas as pd
 import requests
 from bs4 import BeautifulSoup
-import gzip
-from io import BytesIO
-import json
-import tempfile
+from flask import Flask, Response, jsonify, request, stream_with_context
+from prometheus_client import Counter, Gauge, Histogram
+from requests.adapters import HTTPAdapter
 from warcio.archiveiterator import ArchiveIterator
-import pandas as pd
-import re
-from datetime import datetime
+
+from article_index import ArticleIndex
+from article_store import ArticleStore
+from cdx_cache import CDXCache
+from dedup import BloomDeduper, LRUDeduper, RequestDeduper
+from histogram import GRANULARITIES, DateHistogram
+from jobs import JobQueueFull, JobRunner, JobStore
+from telemetry import instrument, setup_logging, span
+from throttle import HostLimiter, backoff, retry_after
+
+setup_logging("commoncrawl-worker")
+log = logging.getLogger("commoncrawl")
 
 app = Flask(__name__)
+instrument(app)
+
+# Métricas por etapa del pipeline (expuestas en /metrics)
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CDX_FETCH_SECONDS = Histogram("notibolsa_cdx_fetch_seconds", "Time to read one CDX response", ["source"], buckets=LATENCY_BUCKETS)
+CDX_BYTES = Counter("notibolsa_cdx_bytes", "CDX bytes read", ["source"])
+WARC_FETCH_SECONDS = Histogram("notibolsa_warc_fetch_seconds", "Latency of WARC range requests", buckets=LATENCY_BUCKETS)
+WARC_BYTES = Counter("notibolsa_warc_bytes", "WARC bytes downloaded")
+PARSE_SECONDS = Histogram(
+    "notibolsa_parse_seconds", "Title/date extraction time per page", ["method"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+CACHE_LOOKUPS = Counter("notibolsa_cache_lookups", "Cache lookups by cache and result", ["cache", "result"])
+INDEX_CANDIDATES = Counter("notibolsa_index_candidates", "Candidate records per crawl", ["index"])
+INDEX_MATCHES = Counter("notibolsa_index_matches", "Articles accepted per crawl", ["index"])
+QUERY_SECONDS = Histogram("notibolsa_query_seconds", "Duration of /process queries", ["mode", "source"], buckets=LATENCY_BUCKETS + (120, 180))
+UPSTREAM_RATE = Gauge("notibolsa_upstream_rate", "Allowed requests/s per upstream host", ["host"], multiprocess_mode="livesum")
+UPSTREAM_RETRIES = Counter("notibolsa_upstream_retries", "Upstream attempts that were throttled or failed", ["host", "reason"])
+UPSTREAM_WAIT_SECONDS = Counter("notibolsa_upstream_wait_seconds", "Time spent waiting for the host rate limit", ["host"])
+UPSTREAM_FAILURES = Counter("notibolsa_upstream_failures", "CDX pages, WARC ranges and indices given up on", ["kind"])
+
+# Deduplicación de artículos: por petición (por defecto) o compartida entre peticiones
+DEDUP_SCOPE = os.getenv("DEDUP_SCOPE", "request")  # request | global
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", "lru")  # lru | bloom (solo en modo global)
+DEDUP_KEY = os.getenv("DEDUP_KEY", "title")  # title | url
+DEDUP_CAPACITY = int(os.getenv("DEDUP_CAPACITY", 100000))
+DEDUP_FP_RATE = float(os.getenv("DEDUP_FP_RATE", 0.001))
+
+if DEDUP_BACKEND == "bloom":
+    shared_deduper = BloomDeduper(DEDUP_CAPACITY, DEDUP_FP_RATE)
+else:
+    shared_deduper = LRUDeduper(DEDUP_CAPACITY)
+
 
-# Set to track seen titles and avoid duplicates
-seen_titles = set()
+def make_deduper():
+    """Return the deduper for a new request according to DEDUP_SCOPE."""
+    if DEDUP_SCOPE == "global":
+        return shared_deduper
+    return RequestDeduper()
 
 
 def normalize_date(date_str: str) -> str | None:
@@ -75,10 +134,10 @@ def extract_date_from_soup(soup):
                     dp = obj.get("datePublished")
                     if dp:
                         date_news = dp
-                        print(f"[DEBUG] datePublished (JSON-LD): {date_news}", flush=True)
+                        log.debug("datePublished (JSON-LD): %s", date_news)
                         return normalize_date(date_news)
     except Exception as e:
-        print(f"[DEBUG] Error extrayendo JSON-LD: {e}", flush=True)
+        log.debug("Error extrayendo JSON-LD: %s", e)
 
     # Method 2: Extract first_publish_date from Fusion.globalContent JavaScript object
     try:
@@ -98,17 +157,91 @@ def extract_date_from_soup(soup):
                             first_pub = data.get('first_publish_date')
                             if first_pub:
                                 date_news = first_pub
-                                print(f"[DEBUG] first_publish_date (Fusion): {date_news}", flush=True)
+                                log.debug("first_publish_date (Fusion): %s", date_news)
                                 return normalize_date(date_news)
                         except Exception as e:
-                            print(f"[DEBUG] Error parsing Fusion.globalContent: {e}", flush=True)
+                            log.debug("Error parsing Fusion.globalContent: %s", e)
     except Exception as e:
-        print(f"[DEBUG] Error extrayendo first_publish_date: {e}", flush=True)
+        log.debug("Error extrayendo first_publish_date: %s", e)
     
-    print("[DEBUG] No se encontró la fecha en la página usando ningún método.", flush=True)
+    log.debug("No se encontró la fecha en la página usando ningún método.")
     return None
 
 
+_TITLE_RE = re.compile(r"<title[^>]*>(.*?)</title\s*>", re.I | re.S)
+_SCRIPT_RE = re.compile(r"<script\b([^>]*)>(.*?)</script\s*>", re.I | re.S)
+_LD_JSON_ATTR_RE = re.compile(r"""type\s*=\s*["']?application/ld\+json""", re.I)
+_JS_ATTR_RE = re.compile(r"""type\s*=\s*["']?application/javascript""", re.I)
+
+
+def extract_article_fast(html_content: str):
+    """
+    Extract title and publication date without building a DOM.
+    Scans only <title> and <script> blocks with regular expressions and applies
+    the same JSON-LD and Fusion.globalContent rules as extract_date_from_soup.
+    Returns: (title, normalized date or None, method or None)
+    """
+    m = _TITLE_RE.search(html_content)
+    title = html.unescape(m.group(1)).strip() if m else ""
+    title = title or "No title"
+
+    fusion = None
+    for attrs, body in _SCRIPT_RE.findall(html_content):
+        if _LD_JSON_ATTR_RE.search(attrs):
+            raw = body.strip()
+            if not raw:
+                continue
+            try:
+                data = json.loads(raw)
+            except Exception:
+                continue
+            objs = data if isinstance(data, list) else [data]
+            for obj in objs:
+                if isinstance(obj, dict) and obj.get("@type") in ("NewsArticle", "Article", "BlogPosting"):
+                    dp = obj.get("datePublished")
+                    if dp:
+                        return title, normalize_date(dp), "json-ld"
+        elif fusion is None and _JS_ATTR_RE.search(attrs) and 'Fusion.globalContent=' in body:
+            fusion = body
+
+    if fusion is not None:
+        start = fusion.find('Fusion.globalContent=') + len('Fusion.globalContent=')
+        end = fusion.find(';', start)
+        if end != -1:
+            try:
+                first_pub = json.loads(fusion[start:end].strip()).get('first_publish_date')
+            except Exception:
+                first_pub = None
+            if first_pub:
+                return title, normalize_date(first_pub), "fusion"
+
+    return title, None, None
+
+
+# Reintentar con BeautifulSoup cuando el extractor rápido no encuentra la fecha
+HTML_SOUP_FALLBACK = os.getenv("HTML_SOUP_FALLBACK", "1").lower() in ("1", "true", "yes")
+
+
+def extract_article(html_content: str, soup_fallback: bool = HTML_SOUP_FALLBACK):
+    """
+    Extract title and date with the fast scanner, falling back to a full
+    BeautifulSoup parse when it finds no date.
+    Returns: (title, normalized date or None, method or None)
+    """
+    try:
+        title, date_news, method = extract_article_fast(html_content)
+    except Exception as e:
+        log.debug("Error en extractor rápido: %s", e)
+        title, date_news, method = "No title", None, None
+    if date_news is None and soup_fallback:
+        soup = BeautifulSoup(html_content, 'html.parser')
+        title_tag = soup.find('title')
+        title = title_tag.get_text(strip=True) if title_tag else "No title"
+        date_news = extract_date_from_soup(soup)
+        method = "soup" if date_news else None
+    return title, date_news, method
+
+
 CC_INDICES = [
     "CC-MAIN-2008-2009",
     "CC-MAIN-2009-2010",
@@ -231,164 +364,1154 @@ CC_INDICES = [
 ]
 
 
-@app.route("/process", methods=["GET"])
-def process():
-    print("=== INICIO DE PROCESS ===", flush=True)
-    #domain = request.args.get("term")
-    index = request.args.get("index")
-    print(f"[DEBUG] Parámetro index recibido: '{index}'", flush=True)
-    keyword = request.args.get("keyword")
-    print(f"[DEBUG] Parámetro keyword recibido: '{keyword}'", flush=True)
-    start_date = request.args.get("start_date")
-    print(f"[DEBUG] Parámetro start_date recibido: '{start_date}'", flush=True)
-    end_date = request.args.get("end_date")
-    print(f"[DEBUG] Parámetro end_date recibido: '{end_date}'", flush=True)
-
-    #Crear los rangos entre start y end con frequency MS (month start):
-    date_ranges = []
-        #Crear los rangos mensuales entre start y end (primer día de cada mes)
-    for date in pd.date_range(start=start_date, end=end_date, freq='MS'):
-        print("Date: ", date, flush=True)
-        date_ranges.append([date.strftime('%Y-%m-%d'), 0])
-    print(f"[DEBUG] Rangos de fechas creados: {date_ranges}", flush=True)
+def crawl_window(idx: str) -> tuple[date, date] | None:
+    """
+    Derive the capture window of a crawl from its name.
+    CC-MAIN-YYYY-WW is named after the ISO week WW in which the crawl finished
+    (it runs for about two weeks before, e.g. CC-MAIN-2020-05 ran Jan 17-29), so
+    its window is taken as [Monday of WW - 14 days, Sunday of WW].
+    CC-MAIN-YYYY and CC-MAIN-YYYY-YYYY are the older multi-month archives.
+    Returns None for names that do not follow the pattern.
+    """
+    parts = idx.split("-")
+    if len(parts) < 3 or parts[0] != "CC" or parts[1] != "MAIN":
+        return None
+    try:
+        year = int(parts[2])
+        if len(parts) == 3:
+            return date(year, 1, 1), date(year, 12, 31)
+        second = int(parts[3])
+        if second > 1000:
+            return date(year, 1, 1), date(second, 12, 31)
+        monday = date.fromisocalendar(year, second, 1)
+        return monday - timedelta(days=14), monday + timedelta(days=6)
+    except ValueError:
+        return None
 
 
-    if index:
-        indices_to_search = [i.strip() for i in index.split(",") if i.strip()]
-        print(f"[DEBUG] Indices a buscar: {indices_to_search}", flush=True)
-    else:
-        indices_to_search = CC_INDICES
-        print(f"[DEBUG] Usando todos los índices predefinidos", flush=True)
+# Tabla precalculada de fechas de captura por índice
+CRAWL_WINDOWS = {idx: crawl_window(idx) for idx in CC_INDICES}
+
+# Días después de end_date en los que un crawl aún puede capturar noticias del rango
+CC_LOOKAHEAD_DAYS = int(os.getenv("CC_LOOKAHEAD_DAYS", 90))
+
+
+def plan_indices(start_date: str | None, end_date: str | None, lookahead_days: int = CC_LOOKAHEAD_DAYS) -> dict:
+    """
+    Pick the crawls that can contain pages published between start_date and end_date.
+    A crawl qualifies if it ended after start_date and started no later than
+    end_date plus the lookahead. Without a date range every index is used.
+    """
+    if not start_date or not end_date:
+        return {"indices": list(CC_INDICES), "pruned": 0, "lookahead_days": lookahead_days}
+    start = pd.Timestamp(start_date).date()
+    horizon = pd.Timestamp(end_date).date() + timedelta(days=lookahead_days)
+    indices = [
+        idx for idx in CC_INDICES
+        if CRAWL_WINDOWS[idx] is None
+        or (CRAWL_WINDOWS[idx][1] >= start and CRAWL_WINDOWS[idx][0] <= horizon)
+    ]
+    return {
+        "indices": indices,
+        "pruned": len(CC_INDICES) - len(indices),
+        "lookahead_days": lookahead_days,
+    }
+
+
+# Concurrencia del fan-out sobre los índices CDX
+CC_WORKERS = int(os.getenv("CC_WORKERS", 8))
+CC_PER_HOST_LIMIT = int(os.getenv("CC_PER_HOST_LIMIT", 4))
+
+# Tasa adaptativa por host (AIMD, peticiones/s por proceso)
+CC_RATE_INITIAL = float(os.getenv("CC_RATE_INITIAL", 5))
+CC_RATE_MIN = float(os.getenv("CC_RATE_MIN", 0.5))
+CC_RATE_MAX = float(os.getenv("CC_RATE_MAX", 50))
+CC_RATE_INCREASE = float(os.getenv("CC_RATE_INCREASE", 1))
+CC_RATE_DECREASE = float(os.getenv("CC_RATE_DECREASE", 0.5))
+
+_host_slots = {}
+_host_limiters = {}
+_host_slots_lock = threading.Lock()
+
+
+def host_slot(url: str) -> threading.BoundedSemaphore:
+    """
+    Return the semaphore that bounds concurrent requests to the host of `url`.
+    At most CC_PER_HOST_LIMIT requests run against the same host at once.
+    """
+    host = urlparse(url).netloc
+    with _host_slots_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = threading.BoundedSemaphore(CC_PER_HOST_LIMIT)
+            _host_slots[host] = slot
+        return slot
+
+
+def host_limiter(url: str) -> HostLimiter:
+    """Return the rate limiter shared by every request to the host of `url`."""
+    host = urlparse(url).netloc
+    with _host_slots_lock:
+        limiter = _host_limiters.get(host)
+        if limiter is None:
+            limiter = HostLimiter(CC_RATE_INITIAL, CC_RATE_MIN, CC_RATE_MAX, CC_RATE_INCREASE, CC_RATE_DECREASE)
+            _host_limiters[host] = limiter
+        return limiter
+
+
+# Sesión HTTP compartida: pools de conexiones keep-alive por host; los
+# reintentos los hace limited_get para que cada respuesta ajuste la tasa del host
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 32))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", 0.5))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", 20))
+HTTP_RETRY_AFTER_MAX = float(os.getenv("HTTP_RETRY_AFTER_MAX", 60))
+THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class QueryStopped(UpstreamError):
+    """An upstream request abandoned because its query was stopped (cap, deadline or cancel)."""
 
+
+def make_session() -> requests.Session:
+    """Build a Session whose adapters keep up to HTTP_POOL_SIZE connections alive per host."""
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=HTTP_POOL_SIZE)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+http = make_session()
+
+# Cancelación y plazo (time.monotonic) de la consulta en curso (se propagan a los hilos con copy_context)
+_cancel = contextvars.ContextVar("cancel", default=(None, None))
+
+
+@contextmanager
+def cancel_scope(stop_event: threading.Event, deadline: float | None = None):
+    """Make upstream requests of the enclosed work give up once stop_event is set or `deadline` passes."""
+    token = _cancel.set((stop_event, deadline))
+    try:
+        yield
+    finally:
+        _cancel.reset(token)
+
+
+def limited_get(url: str, **kwargs):
+    """
+    GET through the shared session at the host's current rate, respecting the
+    per-host concurrency limit. 429/5xx answers and connection errors lower
+    the rate and are retried up to HTTP_RETRIES times with jittered backoff
+    (or after Retry-After); the last response, or error, is returned to the caller.
+    Inside a cancel_scope, timeouts are capped at the time left, and waits are
+    cut short (raising QueryStopped) once the query is stopped or out of time.
+    """
+    host = urlparse(url).netloc
+    limiter = host_limiter(url)
+    stop_event, deadline = _cancel.get()
+    for attempt in range(HTTP_RETRIES + 1):
+        pause = None
+        with host_slot(url):
+            waited = limiter.acquire(stop_event, deadline)
+            if waited is None:
+                raise QueryStopped(f"{host}: consulta detenida esperando turno")
+            UPSTREAM_WAIT_SECONDS.labels(host).inc(waited)
+            if deadline is not None and isinstance(kwargs.get("timeout"), (int, float)):
+                kwargs["timeout"] = max(0.1, min(kwargs["timeout"], deadline - time.monotonic()))
+            try:
+                with span("GET " + host, url=url, attempt=attempt):
+                    resp = http.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                resp, reason = None, type(e).__name__
+                error = e
+            else:
+                if resp.status_code not in THROTTLE_STATUSES:
+                    limiter.succeeded()
+                    UPSTREAM_RATE.labels(host).set(limiter.rate)
+                    return resp
+                reason = str(resp.status_code)
+                pause = retry_after(resp.headers.get("Retry-After"), HTTP_RETRY_AFTER_MAX)
+            limiter.throttled(pause)
+        UPSTREAM_RATE.labels(host).set(limiter.rate)
+        UPSTREAM_RETRIES.labels(host, reason).inc()
+        delay = pause + random.uniform(0, HTTP_BACKOFF) if pause else backoff(attempt, HTTP_BACKOFF, HTTP_BACKOFF_MAX)
+        # Sin reintento si la espera no cabe en el plazo de la consulta
+        if attempt == HTTP_RETRIES or (deadline is not None and time.monotonic() + delay >= deadline):
+            if resp is None:
+                raise error
+            return resp
+        if resp is not None:
+            resp.close()
+        log.warning("%s respondió %s, reintento %d en %.1fs (tasa %.2f/s)", host, reason, attempt + 1, delay, limiter.rate)
+        if stop_event is None:
+            time.sleep(delay)
+        elif stop_event.wait(delay):
+            raise QueryStopped(f"{host} respondió {reason}; consulta detenida antes de reintentar")
+
+
+class FailureLog:
+    """
+    Upstream work a query had to give up on (CDX page listings, WARC ranges,
+    whole indices), so results report what they are missing instead of
+    silently undercounting. Keeps the first MAX_ITEMS entries in detail.
+    """
+
+    MAX_ITEMS = 50
+
+    def __init__(self):
+        self.count = 0
+        self.indices = set()
+        self.items = []
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, idx: str | None, error, **where) -> None:
+        with self._lock:
+            self.count += 1
+            if idx:
+                self.indices.add(idx)
+            if len(self.items) < self.MAX_ITEMS:
+                self.items.append({"kind": kind, "index": idx, **where, "error": str(error)})
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {"count": self.count, "indices": sorted(self.indices), "items": list(self.items)}
+
+
+# Registro de fallos de la consulta en curso (se propaga a los hilos con copy_context)
+_failures = contextvars.ContextVar("failures", default=None)
+
+
+@contextmanager
+def failure_scope(failures: FailureLog):
+    """Record the upstream failures of the enclosed work (and of threads started from it) in `failures`."""
+    token = _failures.set(failures)
+    try:
+        yield failures
+    finally:
+        _failures.reset(token)
+
+
+def record_failure(kind: str, idx: str | None, error, **where) -> None:
+    if isinstance(error, QueryStopped):
+        # No falta nada por culpa del upstream: la consulta ya terminó (tope, plazo o cancelación)
+        log.debug("Petición abandonada (%s) en %s: %s", kind, idx, error)
+        return
+    UPSTREAM_FAILURES.labels(kind).inc()
+    log.warning("Fallo definitivo (%s) en %s %s: %s", kind, idx, where or "", error)
+    failures = _failures.get()
+    if failures is not None:
+        failures.add(kind, idx, error, **where)
+
+
+def fan_out(items, worker, stop_event: threading.Event):
+    """
+    Run worker(item) for every item on a bounded thread pool.
+    Yields (item, result) as each call completes. Once stop_event is set,
+    pending calls are cancelled and the generator returns.
+    """
+    pool = ThreadPoolExecutor(max_workers=CC_WORKERS)
+    futures = {pool.submit(contextvars.copy_context().run, worker, item): item for item in items}
+    try:
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                log.error("Error procesando %s: %s", item, e)
+                record_failure("index", item, e)
+                result = None
+            yield item, result
+            if stop_event.is_set():
+                break
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Servidores de Common Crawl (configurables para apuntar a réplicas locales en pruebas de carga)
+CC_INDEX_SERVER = os.getenv("CC_INDEX_SERVER", "https://index.commoncrawl.org")
+CC_DATA_SERVER = os.getenv("CC_DATA_SERVER", "https://data.commoncrawl.org")
+
+CDX_DOMAIN = "elespectador.com/*"
+# Campos que el pipeline realmente lee de cada registro CDX
+CDX_FIELDS = "url,filename,offset,length"
+# Líneas por bloque ZipNum del índice (para estimar totales con showNumPages)
+CDX_BLOCK_LINES = int(os.getenv("CDX_BLOCK_LINES", 3000))
+
+
+def cdx_url(idx: str, keyword: str | None = None, fields: str = CDX_FIELDS, page: int | None = None) -> str:
+    """
+    Build a CDX query that lets the index server do the filtering: only
+    successful HTML captures, optionally only URLs containing `keyword`,
+    projected to the fields in `fields`.
+    """
+    params = [
+        ("url", CDX_DOMAIN),
+        ("output", "json"),
+        ("fl", fields),
+        ("filter", "status:200"),
+        ("filter", "mime:text/html"),
+    ]
     if keyword:
-        max_results = 20  # Limitar para evitar sobrecarga
-        matching_urls = []
-        lines_count = 0
-
-        for idx in indices_to_search:
-            url = (
-                f"https://index.commoncrawl.org/{idx}-index"
-                f"?url=elespectador.com/*&output=json"
-            )
-            print(f"Consultando: {url}", flush=True)
+        params.append(("filter", f"~url:{keyword.lower()}"))
+    if page is not None:
+        params.append(("page", page))
+    return f"{CC_INDEX_SERVER}/{idx}-index?{urlencode(params)}"
+
+
+def cdx_pages_url(idx: str) -> str:
+    params = [("url", CDX_DOMAIN), ("output", "json"), ("showNumPages", "true")]
+    return f"{CC_INDEX_SERVER}/{idx}-index?{urlencode(params)}"
+
+
+# Caché persistente de respuestas CDX (los crawls publicados no cambian)
+CDX_CACHE_DIR = os.getenv("CDX_CACHE_DIR", os.path.join(tempfile.gettempdir(), "notibolsa-cdx"))
+CDX_CACHE_MAX_BYTES = int(os.getenv("CDX_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+CDX_CACHE_TTL = int(os.getenv("CDX_CACHE_TTL", 24 * 3600))
+
+_known_indices = set(CC_INDICES)
+cdx_cache = (
+    CDXCache(CDX_CACHE_DIR, CDX_CACHE_MAX_BYTES, CDX_CACHE_TTL, lambda idx: idx in _known_indices)
+    if CDX_CACHE_DIR
+    else None
+)
+
+
+CDX_CHUNK_SIZE = 64 * 1024
+
+
+def cdx_chunks(idx: str, url: str):
+    """
+    Yield the raw response of a CDX query as byte chunks, from the on-disk
+    cache when possible. A response is only cached once it has been read to
+    the end; closing the generator early closes the connection instead.
+    A 404 ("No Captures found") on an immutable index is cached as an empty entry.
+    """
+    if cdx_cache is not None:
+        try:
+            chunks = cdx_cache.iter_chunks(idx, url, CDX_CHUNK_SIZE)
+        except sqlite3.Error as e:
+            log.error("Error leyendo caché CDX: %s", e)
+            chunks = None
+        CACHE_LOOKUPS.labels("cdx", "miss" if chunks is None else "hit").inc()
+        if chunks is not None:
+            log.debug("Caché CDX: %s", idx)
+            started = time.perf_counter()
+            for chunk in chunks:
+                CDX_BYTES.labels("cache").inc(len(chunk))
+                yield chunk
+            CDX_FETCH_SECONDS.labels("cache").observe(time.perf_counter() - started)
+            return
+    log.debug("Consultando: %s", url)
+    started = time.perf_counter()
+    with limited_get(url, timeout=15, stream=True) as r:
+        log.debug("Status code: %s", r.status_code)
+        if r.status_code == 404:
+            # "No Captures found": la consulta filtrada no tiene resultados. En un índice
+            # inmutable se guarda como entrada vacía para no volver a consultarla
+            if cdx_cache is not None and cdx_cache.is_immutable(idx):
+                try:
+                    cdx_cache.writer().commit(idx, url)
+                except sqlite3.Error as e:
+                    log.error("Error escribiendo caché CDX: %s", e)
+            return
+        if r.status_code != 200:
+            raise UpstreamError(f"CDX respondió {r.status_code}")
+        writer = cdx_cache.writer() if cdx_cache is not None else None
+        for chunk in r.iter_content(CDX_CHUNK_SIZE):
+            CDX_BYTES.labels("network").inc(len(chunk))
+            if writer is not None:
+                writer.write(chunk)
+            yield chunk
+        CDX_FETCH_SECONDS.labels("network").observe(time.perf_counter() - started)
+        if writer is not None:
             try:
-                r = requests.get(url, timeout=15)
-                if r.status_code == 200:
-                    lines = r.text.splitlines()
-                    lines_count += len(lines)
-                    print(f"Líneas recibidas: {len(lines)}", flush=True)
-                    for i, line in enumerate(lines):
-                        if len(matching_urls) >= max_results:
-                            break
-                        try:
-                            record = json.loads(line)
-                        except Exception as e:
-                            print(f"Error parseando línea JSON: {e}", flush=True)
-                            continue
-                        warc_filename = record.get("filename")
-                        offset = int(record.get("offset", 0))
-                        length = int(record.get("length", 0))
-                        page_url = record.get("url", "")
-                        warc_url = f"https://data.commoncrawl.org/{warc_filename}"
-                        headers = {"Range": f"bytes={offset}-{offset + length - 1}"}
-                        try:
-                            #print("Analizando pagina: ", page_url, flush=True)
-                            if keyword.lower() in page_url:
-                                print(f"Coincidencia encontrada", flush=True)
-                                warc_resp = requests.get(warc_url, headers=headers, timeout=20)
-                                if warc_resp.status_code == 206:
-                                    with gzip.GzipFile(fileobj=BytesIO(warc_resp.content)) as gz:
-                                        warc_stream = BytesIO(gz.read())
-                                        for warc_record in ArchiveIterator(warc_stream):
-                                            if warc_record.rec_type == 'response' and 'html' in warc_record.http_headers.get('Content-Type', '').lower():        
-                                                html_content = warc_record.content_stream().read().decode('utf-8', errors='ignore')
-                                                soup = BeautifulSoup(html_content, 'html.parser')   
-                                                #text = soup.get_text(separator=' ', strip=True).lower()
-
-                                                # Extract title
-                                                title_tag = soup.find('title')
-                                                title = title_tag.get_text(strip=True) if title_tag else "No title"
-                                                print(f"[DEBUG] Title: {title}", flush=True)
-                                                    
-                                                # Check if title already seen
-                                                if title in seen_titles:
-                                                    print(f"[DEBUG] Título duplicado, saltando: {title}", flush=True)
-                                                    continue
-                                                
-
-                                                # Intentar extraer datePublished desde JSON-LD (NewsArticle/Article/BlogPosting)
-                                                date_news = extract_date_from_soup(soup)
-                                                print(f"[DEBUG] date_news: {date_news}", flush=True)
-                                                # Limpiar scripts y estilos para el resto del parseo
-                                                for tag in soup(["script", "style"]):
-                                                    tag.extract()
-                                                
-                                                if date_news is None:
-                                                    continue
-                                                else:
-                                                    seen_titles.add(title)
-                                                    matching_urls.append(page_url)
-                                                    print(f"[DEBUG] Nuevo título agregado al conjunto. Total títulos únicos: {len(seen_titles)}", flush=True)
-                                                    print(f"[DEBUG] Original date: {date_news}", flush=True)
-
-                                                
-                                                # Contar el numero de noticias por rango de fecha
-                                                for i in range(len(date_ranges)-1):
-                                                    if date_news<=date_ranges[i][0]:
-                                                        if i==0:
-                                                            print(f"[DEBUG] La noticia del {date_news} cae antes del primer rango {date_ranges[i][0]}", flush=True)
-                                                            
-                                                        else:
-                                                            if date_news>date_ranges[i-1][0]:
-                                                                date_ranges[i-1][1] += 1
-                                                                print(f"[DEBUG] Incrementando contador para rango {date_ranges[i-1]}", flush=True)
-                                                    #else:
-                                                        #print(f"[DEBUG] La noticia del {date_news} cae después del rango {date_ranges[i][0]}", flush=True)
-            
-                                                
-                        except Exception as e:
-                            print(f"Error al descargar/procesar WARC: {e}", flush=True)
+                writer.commit(idx, url)
+            except sqlite3.Error as e:
+                log.error("Error escribiendo caché CDX: %s", e)
+
+
+def cdx_page_info(idx: str) -> dict:
+    """
+    Return the index's pagination metadata for the domain
+    ({"pages": ..., "pageSize": ..., "blocks": ...}).
+    Falls back to a single page if the server does not report it.
+    """
+    try:
+        info = json.loads(b"".join(cdx_chunks(idx, cdx_pages_url(idx))))
+    except Exception as e:
+        record_failure("cdx_pages", idx, e)
+        return {"pages": 1, "blocks": 0}
+    if not isinstance(info, dict):
+        return {"pages": 1, "blocks": 0}
+    return info
+
+
+def iter_lines(chunks):
+    """Split a stream of byte chunks into non-empty lines."""
+    pending = b""
+    for chunk in chunks:
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line:
+                yield line
+    if pending:
+        yield pending
+
+
+class MatchCollector:
+    """
+    Thread-safe sink for articles found by the index workers.
+    When the histogram has a date range only articles inside it are accepted,
+    as in the article index path; they are deduplicated by title (or URL, see
+    DEDUP_KEY) and bucketed, and `stop_event` is set once `max_results` matches
+    have been collected. Which matches fill the cap follows arrival order here
+    and date order in the index.
+    """
+
+    def __init__(self, histogram: DateHistogram, max_results: int, stop_event: threading.Event,
+                 deduper=None, on_match=None):
+        self.histogram = histogram
+        self.on_match = on_match
+        self.max_results = max_results
+        self.stop_event = stop_event
+        self.deduper = deduper if deduper is not None else make_deduper()
+        self.matching_urls = []
+        self._lock = threading.Lock()
+
+    def add(self, page_url: str, title: str, date_news: str) -> bool:
+        """
+        Record a match. Returns False if it was out of range, a duplicate, the
+        cap was reached or the query was stopped (parses still running then
+        must not change a result that is already being returned).
+        """
+        with self._lock:
+            if self.stop_event.is_set() or len(self.matching_urls) >= self.max_results:
+                return False
+            if self.histogram.upper is not None and self.histogram.bucket(date_news) is None:
+                log.debug("La noticia del %s cae fuera de los rangos", date_news)
+                self.histogram.out_of_range += 1
+                return False
+            if not self.deduper.add(page_url if DEDUP_KEY == "url" else title):
+                log.debug("Título duplicado, saltando: %s", title)
+                return False
+            self.matching_urls.append(page_url)
+            log.debug("Nuevo título agregado al conjunto. Total títulos únicos: %d", len(self.deduper))
+            log.debug("Original date: %s", date_news)
+            self.histogram.add(date_news)
+            if len(self.matching_urls) >= self.max_results:
+                self.stop_event.set()
+        if self.on_match is not None:
+            self.on_match()
+        return True
+
+    def snapshot(self) -> tuple[list, list]:
+        """Consistent copies of (matching_urls, date_ranges_counts)."""
+        with self._lock:
+            return list(self.matching_urls), self.histogram.as_list()
+
+
+def fetch_warc_range(record: dict) -> bytes:
+    """Download the gzipped WARC record described by a CDX line. Raises UpstreamError if it is not served."""
+    warc_filename = record.get("filename")
+    offset = int(record.get("offset", 0))
+    length = int(record.get("length", 0))
+    warc_url = f"{CC_DATA_SERVER}/{warc_filename}"
+    headers = {"Range": f"bytes={offset}-{offset + length - 1}"}
+    started = time.perf_counter()
+    warc_resp = limited_get(warc_url, headers=headers, timeout=20)
+    if warc_resp.status_code != 206:
+        raise UpstreamError(f"WARC respondió {warc_resp.status_code}")
+    WARC_FETCH_SECONDS.observe(time.perf_counter() - started)
+    WARC_BYTES.inc(len(warc_resp.content))
+    return warc_resp.content
+
+
+def parse_warc_record(payload: bytes):
+    """
+    Extract title, publication date and extraction method from a gzipped WARC record.
+    Runs in the parse process pool. Returns (title, date_news, method), where
+    date_news is None if the page has no date, or None if there is no HTML response.
+    """
+    with gzip.GzipFile(fileobj=BytesIO(payload)) as gz:
+        warc_stream = BytesIO(gz.read())
+        for warc_record in ArchiveIterator(warc_stream):
+            if warc_record.rec_type == 'response' and 'html' in warc_record.http_headers.get('Content-Type', '').lower():
+                html_content = warc_record.content_stream().read().decode('utf-8', errors='ignore')
+                title, date_news, method = extract_article(html_content)
+                log.debug("Title: %s", title)
+                log.debug("date_news: %s (%s)", date_news, method)
+                return title, date_news, method
+    return None
+
+
+def parse_warc_timed(payload: bytes):
+    """parse_warc_record plus its duration in seconds, measured inside the parse process."""
+    started = time.perf_counter()
+    article = parse_warc_record(payload)
+    return article, time.perf_counter() - started
+
+
+# Almacén persistente de artículos ya extraídos, por coordenadas WARC y URL
+ARTICLE_STORE_DIR = os.getenv("ARTICLE_STORE_DIR", os.path.join(tempfile.gettempdir(), "notibolsa-articles"))
+article_store = ArticleStore(ARTICLE_STORE_DIR) if ARTICLE_STORE_DIR else None
+
+# Índice local de artículos construido offline con ingest.py
+ARTICLE_INDEX_DIR = os.getenv("ARTICLE_INDEX_DIR", os.path.join(tempfile.gettempdir(), "notibolsa-index"))
+article_index = ArticleIndex(ARTICLE_INDEX_DIR) if ARTICLE_INDEX_DIR else None
+QUERY_SOURCES = ("auto", "index", "live")
+# Coincidencias por consulta con keyword, igual desde el índice que en vivo
+MAX_RESULTS = int(os.getenv("MAX_RESULTS", 20))
+
+
+# Etapas del pipeline de artículos: CDX -> cola -> descargas WARC -> pool de parseo
+WARC_FETCH_WORKERS = int(os.getenv("WARC_FETCH_WORKERS", 8))
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", os.cpu_count() or 2))
+CANDIDATE_QUEUE_SIZE = int(os.getenv("CANDIDATE_QUEUE_SIZE", 64))
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """Return the shared process pool used for HTML parsing."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+        return _parse_pool
+
+
+class ArticlePipeline:
+    """
+    Producer/consumer pipeline for keyword mode.
+    CDX scanners put candidate records on a bounded queue, fetch threads
+    download the WARC ranges and hand the payload to the parse process pool,
+    and every parsed article is passed to the collector as it completes.
+    Once the collector's stop_event is set, queued records are dropped and
+    pending parses are cancelled.
+    """
+
+    _DONE = object()
+
+    def __init__(self, collector: MatchCollector):
+        self.collector = collector
+        self.stop_event = collector.stop_event
+        self.candidates = queue.Queue(maxsize=CANDIDATE_QUEUE_SIZE)
+        self.queued = 0
+        self.fetched = 0
+        self.stored = 0
+        self._pending = set()
+        self._inflight = 0
+        self._idle = threading.Condition()
+        self._fetchers = [
+            threading.Thread(target=contextvars.copy_context().run, args=(self._fetch_loop,), daemon=True)
+            for _ in range(WARC_FETCH_WORKERS)
+        ]
+        for t in self._fetchers:
+            t.start()
+
+    def put(self, record: dict) -> bool:
+        """Queue a candidate record. Returns False once the pipeline is stopping."""
+        while not self.stop_event.is_set():
+            try:
+                self.candidates.put(record, timeout=0.5)
+                if record is not self._DONE:
+                    with self._idle:
+                        self.queued += 1
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fetch_loop(self):
+        while True:
+            record = self.candidates.get()
+            if record is self._DONE or self.stop_event.is_set():
+                return
+            if self._from_store(record):
+                continue
+            try:
+                payload = fetch_warc_range(record)
+            except Exception as e:
+                record_failure("warc", record.get("index"), e, url=record.get("url"),
+                               filename=record.get("filename"), offset=record.get("offset"), length=record.get("length"))
+                continue
+            if self.stop_event.is_set():
+                continue
+            with self._idle:
+                self.fetched += 1
+                self._inflight += 1
+            try:
+                future = get_parse_pool().submit(parse_warc_timed, payload)
             except Exception as e:
-                print(f"Error al consultar {url}: {e}", flush=True)
-            if len(matching_urls) >= max_results:
+                log.error("Error enviando WARC al pool de parseo: %s", e)
+                self._release(None)
+                continue
+            with self._idle:
+                self._pending.add(future)
+            future.add_done_callback(lambda f, record=record: self._on_parsed(record, f))
+
+    def _from_store(self, record: dict) -> bool:
+        """Answer a candidate from the article store. Returns True on a hit."""
+        if article_store is None:
+            return False
+        try:
+            article = article_store.lookup(record)
+        except sqlite3.Error as e:
+            log.error("Error leyendo almacén de artículos: %s", e)
+            return False
+        CACHE_LOOKUPS.labels("article_store", "miss" if article is None else "hit").inc()
+        if article is None:
+            return False
+        with self._idle:
+            self.stored += 1
+        title, date_news, method = article
+        self._collect(record, title, date_news)
+        return True
+
+    def _collect(self, record: dict, title, date_news) -> None:
+        if date_news is not None and self.collector.add(record.get("url", ""), title, date_news):
+            INDEX_MATCHES.labels(record.get("index", "")).inc()
+
+    def _on_parsed(self, record: dict, future):
+        try:
+            if not future.cancelled():
+                article, seconds = future.result()
+                title, date_news, method = article or (None, None, None)
+                PARSE_SECONDS.labels(method or "none").observe(seconds)
+                if article_store is not None:
+                    try:
+                        article_store.put(record, title, date_news, method)
+                    except sqlite3.Error as e:
+                        log.error("Error escribiendo almacén de artículos: %s", e)
+                self._collect(record, title, date_news)
+        except Exception as e:
+            log.error("Error al procesar WARC: %s", e)
+        finally:
+            self._release(future)
+
+    def _release(self, future):
+        with self._idle:
+            self._pending.discard(future)
+            self._inflight -= 1
+            self._idle.notify_all()
+
+    def close(self):
+        """
+        Wait for queued candidates to be fetched and parsed. If the pipeline
+        was stopped, drop whatever is still outstanding instead.
+        """
+        if self.stop_event.is_set():
+            self._cancel()
+            return
+        for _ in self._fetchers:
+            if not self.put(self._DONE):
+                break
+        else:
+            # Con tiempo de espera: un fetcher en pleno reintento no debe retener la consulta detenida
+            for t in self._fetchers:
+                while t.is_alive() and not self.stop_event.is_set():
+                    t.join(timeout=0.5)
+            with self._idle:
+                while self._inflight > 0 and not self.stop_event.is_set():
+                    self._idle.wait(timeout=0.5)
+        if self.stop_event.is_set():
+            self._cancel()
+
+    def _cancel(self):
+        while True:
+            try:
+                self.candidates.get_nowait()
+            except queue.Empty:
+                break
+        for _ in self._fetchers:
+            try:
+                self.candidates.put_nowait(self._DONE)
+            except queue.Full:
+                break
+        with self._idle:
+            pending = list(self._pending)
+        for future in pending:
+            future.cancel()
+
+
+def scan_index(idx: str, keyword: str, pipeline: ArticlePipeline) -> int:
+    """
+    Walk the pages of a server-side filtered CDX query and queue the records.
+    Returns the number of CDX lines received.
+    """
+    received = 0
+    pages = int(cdx_page_info(idx).get("pages", 1))
+    for page in range(pages):
+        if pipeline.stop_event.is_set():
+            break
+        lines = iter_lines(cdx_chunks(idx, cdx_url(idx, keyword, page=page)))
+        try:
+            for line in lines:
+                received += 1
+                if pipeline.stop_event.is_set():
+                    break
+                try:
+                    record = json.loads(line)
+                except Exception as e:
+                    log.warning("Error parseando línea JSON: %s", e)
+                    continue
+                record["index"] = idx
+                INDEX_CANDIDATES.labels(idx).inc()
+                if not pipeline.put(record):
+                    break
+        except (requests.RequestException, UpstreamError) as e:
+            record_failure("cdx_page", idx, e, page=page)
+        finally:
+            lines.close()
+    log.info("Líneas recibidas de %s: %d", idx, received)
+    return received
+
+
+def count_page(idx: str, url: str, stop_event: threading.Event | None = None) -> int:
+    """
+    Count the lines of one CDX page on raw chunks, using the cached count when possible.
+    Stops reading (and closes the connection) once stop_event is set.
+    """
+    if cdx_cache is not None:
+        try:
+            cached = cdx_cache.count(idx, url)
+        except sqlite3.Error as e:
+            log.error("Error leyendo caché CDX: %s", e)
+            cached = None
+        if cached is not None:
+            return cached
+    lineas = 0
+    last = b""
+    chunks = cdx_chunks(idx, url)
+    try:
+        for chunk in chunks:
+            if stop_event is not None and stop_event.is_set():
+                break
+            lineas += chunk.count(b"\n")
+            last = chunk[-1:] or last
+    finally:
+        chunks.close()
+    if last not in (b"", b"\n"):
+        lineas += 1
+    return lineas
+
+
+def count_index(idx: str, estimate: bool = False, stop_event: threading.Event | None = None) -> int:
+    """
+    Return the number of HTML captures the index holds for the domain.
+    With `estimate`, answer from the index's block metadata without listing anything.
+    Once stop_event is set the remaining pages are skipped.
+    """
+    info = cdx_page_info(idx)
+    if estimate:
+        return int(info.get("blocks", 0)) * CDX_BLOCK_LINES
+    lineas = 0
+    for page in range(int(info.get("pages", 1))):
+        if stop_event is not None and stop_event.is_set():
+            break
+        try:
+            lineas += count_page(idx, cdx_url(idx, fields="length", page=page), stop_event)
+        except (requests.RequestException, UpstreamError) as e:
+            record_failure("cdx_page", idx, e, page=page)
+    log.info("Líneas recibidas de %s: %d", idx, lineas)
+    return lineas
+
+
+class QueryState:
+    """
+    Live progress of one query, readable from other threads while it runs.
+    Every change bumps `version` and wakes up threads blocked in wait(), and
+    setting `stop_event` cancels the query. `deadline` (time.monotonic) is
+    when the query will be stopped, if it has one.
+    """
+
+    def __init__(self):
+        self.indices_total = 0
+        self.indices_done = 0
+        self.lines_received = 0
+        self.news_count = 0
+        self.histogram = None
+        self.pipeline = None
+        self.collector = None
+        self.failures = FailureLog()
+        self.stop_event = threading.Event()
+        self.deadline = None
+        self.version = 0
+        self._changed = threading.Condition()
+
+    def touch(self) -> None:
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait(self, version: int, timeout: float) -> int:
+        """Block until the state moves past `version` or `timeout` expires; returns the current version."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout=timeout)
+            return self.version
+
+    def snapshot(self) -> dict:
+        snap = {
+            "indices_total": self.indices_total,
+            "indices_done": self.indices_done,
+            "lines_received": self.lines_received,
+            "failed": self.failures.count,
+        }
+        if self.pipeline is not None:
+            snap["candidates"] = self.pipeline.queued
+            snap["fetched"] = self.pipeline.fetched
+            snap["from_store"] = self.pipeline.stored
+        if self.collector is not None:
+            snap["matches"] = len(self.collector.matching_urls)
+        else:
+            snap["news_count"] = self.news_count
+        return snap
+
+    def partial_result(self) -> dict:
+        """Progress shaped like a /process result, with the histogram so far."""
+        partial = self.snapshot()
+        if self.collector is not None:
+            matching_urls, partial["date_ranges_counts"] = self.collector.snapshot()
+            partial["count"] = len(matching_urls)
+            partial["matching_urls"] = matching_urls
+        elif self.histogram is not None:
+            partial["date_ranges_counts"] = self.histogram.as_list()
+        return partial
+
+
+def query_params(args) -> dict:
+    """
+    Read the /process parameters into a plain, JSON-serializable dict.
+    Raises ValueError for invalid values.
+    """
+    params = {
+        "index": args.get("index"),
+        "keyword": args.get("keyword"),
+        "start_date": args.get("start_date"),
+        "end_date": args.get("end_date"),
+        "granularity": args.get("granularity", "month"),
+        "lookahead_days": int(args.get("lookahead_days", CC_LOOKAHEAD_DAYS)),
+        "estimate": str(args.get("estimate", "")).lower() in ("1", "true", "yes"),
+        "source": args.get("source", "auto"),
+    }
+    if params["granularity"] not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    if params["source"] not in QUERY_SOURCES:
+        raise ValueError(f"source must be one of {', '.join(QUERY_SOURCES)}")
+    for name, value in params.items():
+        log.debug("Parámetro %s recibido: '%s'", name, value)
+    return params
+
+
+def use_index(indices: list, source: str) -> bool:
+    """Whether a keyword query should be answered from the article index."""
+    if article_index is None or source == "live":
+        return False
+    if source == "index":
+        return True
+    try:
+        covered = article_index.covers(indices)
+    except sqlite3.Error as e:
+        log.error("Error leyendo índice de artículos: %s", e)
+        return False
+    CACHE_LOOKUPS.labels("article_index", "hit" if covered else "miss").inc()
+    return covered
+
+
+def query_index(indices: list, keyword: str, histogram: DateHistogram, state: QueryState) -> tuple[list, bool]:
+    """
+    Answer a keyword query from the article index: the first MAX_RESULTS
+    deduplicated matches dated inside the histogram range, oldest first.
+    Returns (urls, truncated).
+    """
+    date_from = histogram.labels[0] if histogram.labels else None
+    date_to = pd.Timestamp(histogram.upper).strftime("%Y-%m-%d") if histogram.upper is not None else None
+    deduper = make_deduper()
+    urls, dates = [], []
+    with span("article_index.search", keyword=keyword):
+        rows = article_index.search(indices, keyword, date_from, date_to)
+    truncated = False
+    for page_url, title, date_news in rows:
+        if deduper.add(page_url if DEDUP_KEY == "url" else title):
+            if len(urls) >= MAX_RESULTS:
+                truncated = True
                 break
-        return jsonify({
+            urls.append(page_url)
+            dates.append(date_news)
+    histogram.add_many(dates)
+    state.indices_done = len(indices)
+    state.touch()
+    return urls, truncated
+
+
+def run_query(params: dict, state: QueryState | None = None) -> dict:
+    """
+    Run a /process query and return its JSON result, including the upstream
+    "failures" (CDX pages, WARC ranges, indices) the counts are missing.
+    """
+    state = state if state is not None else QueryState()
+    with failure_scope(state.failures), cancel_scope(state.stop_event, state.deadline):
+        result = execute_query(params, state)
+    result["failures"] = state.failures.as_dict()
+    return result
+
+
+def execute_query(params: dict, state: QueryState) -> dict:
+    started = time.perf_counter()
+    index = params.get("index")
+    keyword = params.get("keyword")
+    start_date = params.get("start_date")
+    end_date = params.get("end_date")
+    granularity = params.get("granularity", "month")
+
+    histogram = DateHistogram(start_date, end_date, granularity)
+    state.histogram = histogram
+    log.debug("Rangos de fechas creados: %s", histogram.labels)
+
+    plan = None
+    if index:
+        indices_to_search = [i.strip() for i in index.split(",") if i.strip()]
+        log.debug("Indices a buscar: %s", indices_to_search)
+    else:
+        plan = plan_indices(start_date, end_date, params.get("lookahead_days", CC_LOOKAHEAD_DAYS))
+        indices_to_search = plan["indices"]
+        log.debug("Plan de índices: %s (%d descartados)", indices_to_search, plan["pruned"])
+    state.indices_total = len(indices_to_search)
+    state.touch()
+
+    stop_event = state.stop_event
+
+    if keyword and use_index(indices_to_search, params.get("source", "auto")):
+        matching_urls, truncated = query_index(indices_to_search, keyword, histogram, state)
+        QUERY_SECONDS.labels("keyword", "index").observe(time.perf_counter() - started)
+        log.info("%d coincidencias desde el índice de artículos", len(matching_urls))
+        return {
             "domain": "elespectador.com",
             "indices_searched": len(indices_to_search),
             "keyword": keyword,
             "matching_urls": matching_urls,
             "count": len(matching_urls),
-            "date_ranges_counts": date_ranges
-        })
+            "date_ranges_counts": histogram.as_list(),
+            "granularity": granularity,
+            "plan": plan,
+            "source": "index",
+            "max_results": MAX_RESULTS,
+            "truncated": truncated
+        }
+
+    if keyword:
+        collector = MatchCollector(histogram, MAX_RESULTS, stop_event, on_match=state.touch)
+        pipeline = ArticlePipeline(collector)
+        state.collector, state.pipeline = collector, pipeline
 
-    # Si no hay keyword, solo contar
-    total = 0
-    for idx in indices_to_search:
-        url = (
-            f"https://index.commoncrawl.org/{idx}-index"
-            f"?url=elespectador.com/*&output=json"
-        )
-        print(f"Consultando: {url}", flush=True)
         try:
-            r = requests.get(url, timeout=15)
-            print(f"Status code: {r.status_code}", flush=True)
-            print(f"Primeros 500 caracteres de respuesta:\n{r.text[:500]}", flush=True)
-            if r.status_code == 200:
-                lineas = r.text.splitlines()
-                print(f"Líneas recibidas: {len(lineas)}", flush=True)
-                total += len(lineas)
-        except Exception as e:
-            print(f"Error al consultar {url}: {e}", flush=True)
+            for idx, received in fan_out(
+                indices_to_search, lambda idx: scan_index(idx, keyword, pipeline), stop_event
+            ):
+                state.indices_done += 1
+                state.lines_received += received or 0
+                state.touch()
+        finally:
+            pipeline.close()
+        QUERY_SECONDS.labels("keyword", "live").observe(time.perf_counter() - started)
+        matching_urls, date_ranges_counts = collector.snapshot()
+
+        return {
+            "domain": "elespectador.com",
+            "indices_searched": len(indices_to_search),
+            "keyword": keyword,
+            "matching_urls": matching_urls,
+            "count": len(matching_urls),
+            "date_ranges_counts": date_ranges_counts,
+            "granularity": granularity,
+            "plan": plan,
+            "source": "live",
+            "max_results": MAX_RESULTS,
+            "truncated": len(matching_urls) >= MAX_RESULTS
+        }
+
+    # Si no hay keyword, solo contar
+    estimate = params.get("estimate", False)
+    for idx, lines in fan_out(
+        indices_to_search, lambda idx: count_index(idx, estimate, stop_event), stop_event
+    ):
+        state.indices_done += 1
+        state.news_count += lines or 0
+        state.touch()
 
-    print(f"Total news_count: {total}", flush=True)
-    return jsonify({
+    log.info("Total news_count: %d", state.news_count)
+    QUERY_SECONDS.labels("count", "estimate" if estimate else "live").observe(time.perf_counter() - started)
+    return {
         "domain": "elespectador.com",
         "indices_searched": len(indices_to_search),
-        "news_count": total
-    })
+        "news_count": state.news_count,
+        "estimated": estimate,
+        "plan": plan
+    }
 
-if __name__ == "__main__":
-    import os
 
+# Eventos de /process/stream: como mínimo uno cada STREAM_HEARTBEAT segundos
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", 5))
+
+
+def stream_events(params: dict):
+    """
+    Run a query in a background thread and yield events as it progresses:
+    "progress" events with the partial histogram whenever an index finishes
+    or an article matches (or every STREAM_HEARTBEAT seconds), then a final
+    "result" or "error" event. Closing the generator cancels the query.
+    """
+    state = QueryState()
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = run_query(params, state)
+        except Exception as e:
+            log.exception("Error en consulta en streaming: %s", e)
+            outcome["error"] = str(e)
+        finally:
+            state.touch()
+
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True)
+    worker.start()
+    version = -1
+    try:
+        while worker.is_alive():
+            current = state.wait(version, STREAM_HEARTBEAT)
+            if not worker.is_alive():
+                break
+            version = current
+            yield {"type": "progress", **state.partial_result()}
+        worker.join()
+        if "result" in outcome:
+            yield {"type": "result", **outcome["result"]}
+        else:
+            yield {"type": "error", "error": outcome.get("error", "unknown error")}
+    finally:
+        state.stop_event.set()
+
+
+def format_event(event: dict, sse: bool) -> str:
+    data = json.dumps(event)
+    if sse:
+        return f"event: {event['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+@app.route("/process/stream", methods=["GET"])
+def process_stream():
+    """
+    Streaming variant of /process. Emits NDJSON by default, or Server-Sent
+    Events with format=sse or an Accept: text/event-stream header.
+    """
+    try:
+        params = query_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    sse = request.args.get("format") == "sse" or "text/event-stream" in request.headers.get("Accept", "")
+    body = (format_event(event, sse) for event in stream_events(params))
+    return Response(
+        stream_with_context(body),
+        mimetype="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Jobs en segundo plano para consultas largas
+JOB_STORE_DIR = os.getenv("JOB_STORE_DIR", os.path.join(tempfile.gettempdir(), "notibolsa-jobs"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 20))
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", 2))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", 7 * 24 * 3600))
+
+# Un job "queued" o "running" sin actualizarse durante este tiempo pertenecía a un proceso caído
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", max(60, 10 * JOB_PROGRESS_INTERVAL)))
+
+job_store = JobStore(JOB_STORE_DIR)
+job_store.purge(JOB_RETENTION)
+job_runner = JobRunner(job_store, run_query, QueryState, JOB_WORKERS, JOB_QUEUE_SIZE, JOB_PROGRESS_INTERVAL)
+
+
+def submit_job(params: dict):
+    try:
+        job_id = job_runner.submit(params)
+    except JobQueueFull:
+        return jsonify({"error": "Job queue is full"}), 503
+    return jsonify({"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}), 202
+
+
+# Plazo de /process síncrono: por debajo de COMMONCRAWL_TIMEOUT del aggregator,
+# para que este reciba un resultado parcial en lugar de un timeout
+PROCESS_TIMEOUT = float(os.getenv("PROCESS_TIMEOUT", 170))
+
+
+def run_with_deadline(params: dict, timeout: float) -> dict:
+    """Run a query, stopping it after `timeout` seconds with whatever it found so far."""
+    state = QueryState()
+    state.deadline = time.monotonic() + timeout
+    expired = threading.Event()
+
+    def expire():
+        expired.set()
+        state.stop_event.set()
+
+    timer = threading.Timer(timeout, expire)
+    timer.daemon = True
+    timer.start()
+    try:
+        result = run_query(params, state)
+    finally:
+        timer.cancel()
+    if expired.is_set():
+        log.warning("Consulta detenida tras %ss, resultado parcial", timeout)
+        result["timed_out"] = True
+    return result
+
+
+def shutdown() -> None:
+    """Stop running jobs and the parse pool; called by the server when a worker exits."""
+    job_runner.shutdown()
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+
+
+@app.route("/process", methods=["GET"])
+def process():
+    try:
+        params = query_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if request.args.get("async", "").lower() in ("1", "true", "yes"):
+        return submit_job(params)
+    return jsonify(run_with_deadline(params, PROCESS_TIMEOUT))
+
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    try:
+        params = query_params(request.get_json(silent=True) or request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return submit_job(params)
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_store.get(job_id, JOB_STALE_AFTER)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+if __name__ == "__main__":
     port = int(os.getenv("PORT", 5003))
     app.run(host="0.0.0.0", port=port)
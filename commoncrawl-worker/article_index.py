@@ -0,0 +1,167 @@
+"""
+Local index of dated El Espectador articles built by ingest.py.
+
+Articles are stored once per (crawl, URL) in SQLite together with an
+inverted index of URL tokens and the vocabulary of distinct tokens, so
+keyword + date-range queries are answered with index lookups instead of a
+live crawl. Keywords match as URL substrings, like the CDX `~url:` filter of
+the live path: a bare word is looked up as a substring of the (small)
+vocabulary, then through the inverted index, and the final substring check
+runs only on those candidates. The `ingested` table
+records which crawls have been fully walked; /process only trusts the index
+for queries whose crawls are all there.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import unquote
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    id INTEGER PRIMARY KEY,
+    idx TEXT NOT NULL,
+    url TEXT NOT NULL,
+    title TEXT,
+    date TEXT NOT NULL,
+    method TEXT,
+    UNIQUE (idx, url)
+);
+CREATE INDEX IF NOT EXISTS articles_date ON articles (date);
+CREATE TABLE IF NOT EXISTS url_tokens (
+    token TEXT NOT NULL,
+    article_id INTEGER NOT NULL,
+    PRIMARY KEY (token, article_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tokens (
+    token TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ingested (
+    idx TEXT PRIMARY KEY,
+    records INTEGER NOT NULL,
+    articles INTEGER NOT NULL,
+    completed_at REAL NOT NULL
+);
+"""
+
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def url_tokens(text: str) -> set:
+    """Lowercase word tokens of a URL or keyword."""
+    return set(_TOKEN_RE.findall(unquote(text or "").lower()))
+
+
+def keyword_token_filters(keyword: str) -> list:
+    """
+    (token, match) pairs, one per keyword token, that every URL containing
+    `keyword` must satisfy: a token with a separator on both sides inside the
+    keyword is a whole URL token ("exact"), one with a separator only before
+    it starts a URL token ("prefix"), and any other may sit inside a longer
+    URL token ("contains"), as a bare one-word keyword does.
+    """
+    filters = []
+    for m in _TOKEN_RE.finditer(keyword):
+        if m.start() > 0:
+            filters.append((m.group(), "exact" if m.end() < len(keyword) else "prefix"))
+        else:
+            filters.append((m.group(), "contains"))
+    return filters
+
+
+class ArticleIndex:
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "article_index.sqlite3")
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+            # Índices creados antes del vocabulario: se llena una vez desde url_tokens
+            if conn.execute("SELECT NOT EXISTS (SELECT 1 FROM tokens) AND EXISTS (SELECT 1 FROM url_tokens)").fetchone()[0]:
+                conn.execute("INSERT OR IGNORE INTO tokens (token) SELECT DISTINCT token FROM url_tokens")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add_batch(self, idx: str, rows: list) -> None:
+        """
+        Insert (url, title, date, method) rows found in crawl `idx`. A URL
+        already indexed keeps its id (and so its tokens); only its fields change.
+        """
+        conn = self._conn()
+        with conn:
+            for url, title, date, method in rows:
+                conn.execute(
+                    "INSERT INTO articles (idx, url, title, date, method) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (idx, url) DO UPDATE SET "
+                    "title = excluded.title, date = excluded.date, method = excluded.method",
+                    (idx, url, title, date, method),
+                )
+                # lastrowid no es fiable cuando el upsert actualiza una fila existente
+                article_id = conn.execute(
+                    "SELECT id FROM articles WHERE idx = ? AND url = ?", (idx, url)
+                ).fetchone()[0]
+                tokens = url_tokens(url)
+                conn.executemany(
+                    "INSERT OR IGNORE INTO url_tokens (token, article_id) VALUES (?, ?)",
+                    [(token, article_id) for token in tokens],
+                )
+                conn.executemany("INSERT OR IGNORE INTO tokens (token) VALUES (?)", [(token,) for token in tokens])
+
+    def mark_ingested(self, idx: str, records: int, articles: int) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ingested (idx, records, articles, completed_at) VALUES (?, ?, ?, ?)",
+                (idx, records, articles, time.time()),
+            )
+
+    def ingested(self) -> set:
+        return {row[0] for row in self._conn().execute("SELECT idx FROM ingested")}
+
+    def covers(self, indices) -> bool:
+        """True if every crawl in `indices` has been fully ingested."""
+        indices = set(indices)
+        return bool(indices) and indices <= self.ingested()
+
+    def search(self, indices, keyword: str, date_from: str | None, date_to: str | None) -> list:
+        """
+        (url, title, date) of articles in `indices` whose URL contains `keyword`
+        (lowercased, as the live CDX filter), dated in [date_from, date_to), oldest first.
+        """
+        indices = list(indices)
+        keyword = keyword.lower()
+        filters = keyword_token_filters(keyword)
+        # Con tokens, "+idx" evita el índice por crawl para que la búsqueda parta de url_tokens
+        column = "+idx" if filters else "idx"
+        sql = [f"SELECT url, title, date FROM articles WHERE {column} IN ({','.join('?' * len(indices))})"]
+        args = list(indices)
+        sql.append("AND instr(url, ?) > 0")
+        args.append(keyword)
+        if date_from:
+            sql.append("AND date >= ?")
+            args.append(date_from)
+        if date_to:
+            sql.append("AND date < ?")
+            args.append(date_to)
+        for token, match in filters:
+            if match == "exact":
+                sql.append("AND id IN (SELECT article_id FROM url_tokens WHERE token = ?)")
+                args.append(token)
+            elif match == "prefix":
+                sql.append("AND id IN (SELECT article_id FROM url_tokens WHERE token >= ? AND token < ?)")
+                args.extend([token, token + "￿"])
+            else:
+                sql.append(
+                    "AND id IN (SELECT article_id FROM url_tokens "
+                    "WHERE token IN (SELECT token FROM tokens WHERE instr(token, ?) > 0))"
+                )
+                args.append(token)
+        sql.append("ORDER BY date")
+        return self._conn().execute(" ".join(sql), args).fetchall()
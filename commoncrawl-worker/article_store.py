@@ -0,0 +1,78 @@
+"""
+Persistent store of articles already extracted from WARC records.
+
+A record at (warc filename, offset, length) never changes, so its title,
+normalized publication date and extraction method are kept in SQLite and
+looked up before any range request. Pages without a date are stored too
+(date NULL) so they are not downloaded again either.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    filename TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    title TEXT,
+    date TEXT,
+    method TEXT,
+    extracted_at REAL NOT NULL,
+    PRIMARY KEY (filename, offset, length)
+);
+CREATE INDEX IF NOT EXISTS articles_url ON articles (url);
+"""
+
+
+class ArticleStore:
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "articles.sqlite3")
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _coords(record: dict):
+        return record.get("filename"), int(record.get("offset", 0)), int(record.get("length", 0))
+
+    def lookup(self, record: dict):
+        """
+        Return (title, date, method) for a CDX record, or None if it was never extracted.
+        A capture of the same URL from another crawl with a known date also counts as a hit.
+        `date` is None for pages that were extracted without finding a date.
+        """
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT title, date, method FROM articles WHERE filename = ? AND offset = ? AND length = ?",
+            self._coords(record),
+        ).fetchone()
+        if row is None and record.get("url"):
+            row = conn.execute(
+                "SELECT title, date, method FROM articles WHERE url = ? AND date IS NOT NULL "
+                "ORDER BY extracted_at DESC LIMIT 1",
+                (record["url"],),
+            ).fetchone()
+        return row
+
+    def put(self, record: dict, title: str | None, date: str | None, method: str | None) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO articles "
+                "(filename, offset, length, url, title, date, method, extracted_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (*self._coords(record), record.get("url", ""), title, date, method, time.time()),
+            )
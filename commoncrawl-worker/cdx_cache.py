@@ -0,0 +1,185 @@
+"""
+Persistent on-disk cache for CDX index responses.
+
+Entries are keyed by (index, url pattern) and point to a content-addressed,
+zlib-compressed blob in a SQLite database. Responses from immutable indices
+never expire; everything else is refreshed after `ttl` seconds. When the
+stored blobs exceed `max_bytes`, the least recently used entries are evicted.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    idx TEXT NOT NULL,
+    pattern TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    lines INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (idx, pattern)
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at);
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    body BLOB NOT NULL
+);
+"""
+
+
+class CDXCache:
+    def __init__(self, directory: str, max_bytes: int, ttl: float, is_immutable):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "cdx.sqlite3")
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.is_immutable = is_immutable
+        self._local = threading.local()
+        self._evict_lock = threading.Lock()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _entry(self, idx: str, pattern: str):
+        """Return (digest, lines) for a fresh entry, or None."""
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT digest, lines, fetched_at FROM entries WHERE idx = ? AND pattern = ?",
+            (idx, pattern),
+        ).fetchone()
+        if row is None:
+            return None
+        digest, lines, fetched_at = row
+        now = time.time()
+        if not self.is_immutable(idx) and now - fetched_at > self.ttl:
+            return None
+        with conn:
+            conn.execute(
+                "UPDATE entries SET accessed_at = ? WHERE idx = ? AND pattern = ?",
+                (now, idx, pattern),
+            )
+        return digest, lines
+
+    def iter_chunks(self, idx: str, pattern: str, chunk_size: int = 64 * 1024):
+        """
+        Return an iterator over the decompressed response body, or None on a miss.
+        The body is inflated incrementally so it is never held in memory twice.
+        """
+        entry = self._entry(idx, pattern)
+        if entry is None:
+            return None
+        row = self._conn().execute(
+            "SELECT body FROM blobs WHERE digest = ?", (entry[0],)
+        ).fetchone()
+        if row is None:
+            return None
+        return self._inflate(row[0], chunk_size)
+
+    @staticmethod
+    def _inflate(compressed: bytes, chunk_size: int):
+        # CDX JSON compresses roughly 8:1, so this keeps output chunks near chunk_size
+        step = max(chunk_size // 8, 1)
+        d = zlib.decompressobj()
+        view = memoryview(compressed)
+        for start in range(0, len(view), step):
+            out = d.decompress(view[start:start + step])
+            if out:
+                yield out
+        out = d.flush()
+        if out:
+            yield out
+
+    def count(self, idx: str, pattern: str) -> int | None:
+        """Return the cached line count without touching the body, or None on a miss."""
+        entry = self._entry(idx, pattern)
+        return entry[1] if entry else None
+
+    def writer(self) -> "CacheWriter":
+        """Return a writer that compresses a response body as it streams in."""
+        return CacheWriter(self)
+
+    def put_compressed(self, idx: str, pattern: str, digest: str, compressed: bytes, lines: int) -> None:
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO blobs (digest, size, body) VALUES (?, ?, ?)",
+                (digest, len(compressed), compressed),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (idx, pattern, digest, lines, fetched_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (idx, pattern, digest, lines, now, now),
+            )
+        self._evict()
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until the blobs fit in max_bytes."""
+        with self._evict_lock:
+            conn = self._conn()
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = conn.execute(
+                "SELECT e.idx, e.pattern, e.digest, b.size FROM entries e JOIN blobs b ON b.digest = e.digest "
+                "ORDER BY e.accessed_at"
+            ).fetchall()
+            # Los blobs se comparten entre entradas: solo liberan espacio al perder la última
+            refs = {}
+            for _, _, digest, _ in rows:
+                refs[digest] = refs.get(digest, 0) + 1
+            with conn:
+                for idx, pattern, digest, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute(
+                        "DELETE FROM entries WHERE idx = ? AND pattern = ?", (idx, pattern)
+                    )
+                    refs[digest] -= 1
+                    if not refs[digest]:
+                        total -= size
+                conn.execute(
+                    "DELETE FROM blobs WHERE digest NOT IN (SELECT digest FROM entries)"
+                )
+
+
+class CacheWriter:
+    """
+    Incrementally hashes, compresses and counts the lines of a streamed body.
+    Nothing is stored unless commit() is called, so partially read responses
+    never end up in the cache.
+    """
+
+    def __init__(self, cache: CDXCache):
+        self.cache = cache
+        self._sha = hashlib.sha256()
+        self._zlib = zlib.compressobj(6)
+        self._parts = []
+        self.lines = 0
+        self._last = b""
+
+    def write(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        self._sha.update(chunk)
+        self._parts.append(self._zlib.compress(chunk))
+        self.lines += chunk.count(b"\n")
+        self._last = chunk[-1:]
+
+    def commit(self, idx: str, pattern: str) -> None:
+        self._parts.append(self._zlib.flush())
+        lines = self.lines + (1 if self._last not in (b"", b"\n") else 0)
+        self.cache.put_compressed(idx, pattern, self._sha.hexdigest(), b"".join(self._parts), lines)
@@ -0,0 +1,115 @@
+"""
+Duplicate detection for articles found by /process.
+
+Keys (titles or URLs) are normalized and reduced to a 128-bit blake2b
+fingerprint, so memory depends on the number of keys and not their length.
+RequestDeduper lives for a single request; LRUDeduper and BloomDeduper are
+bounded structures meant to be shared across requests.
+"""
+import hashlib
+import math
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+_NON_WORD_RE = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize_key(key: str) -> str:
+    """Casefold, strip accents and collapse punctuation/whitespace."""
+    key = unicodedata.normalize("NFKD", key or "")
+    key = "".join(c for c in key if not unicodedata.combining(c))
+    return _NON_WORD_RE.sub(" ", key.casefold()).strip()
+
+
+def fingerprint(key: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(normalize_key(key).encode("utf-8"), digest_size=16).digest(), "big"
+    )
+
+
+class RequestDeduper:
+    """Exact deduplication for the lifetime of one request."""
+
+    def __init__(self):
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def add(self, key: str) -> bool:
+        """Record key. Returns False if it was already seen."""
+        fp = fingerprint(key)
+        with self._lock:
+            if fp in self._seen:
+                return False
+            self._seen.add(fp)
+            return True
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class LRUDeduper:
+    """Exact deduplication over the `capacity` most recently seen keys."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key: str) -> bool:
+        fp = fingerprint(key)
+        with self._lock:
+            if fp in self._seen:
+                self._seen.move_to_end(fp)
+                return False
+            self._seen[fp] = None
+            if len(self._seen) > self.capacity:
+                self._seen.popitem(last=False)
+            return True
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class BloomDeduper:
+    """
+    Approximate deduplication with two rotating Bloom filters.
+    Each filter is sized for `capacity` keys at `fp_rate`; when the active one
+    fills up it becomes the previous generation and a fresh one takes its place,
+    so memory stays constant and roughly the last `capacity` keys are remembered.
+    """
+
+    def __init__(self, capacity: int, fp_rate: float):
+        self.capacity = capacity
+        self.bits = max(8, int(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self._current = bytearray((self.bits + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, fp: int):
+        h1, h2 = fp >> 64, (fp & ((1 << 64) - 1)) | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    @staticmethod
+    def _contains(bits: bytearray, positions) -> bool:
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def add(self, key: str) -> bool:
+        positions = self._positions(fingerprint(key))
+        with self._lock:
+            if self._contains(self._current, positions) or self._contains(self._previous, positions):
+                return False
+            if self._count >= self.capacity:
+                self._previous = self._current
+                self._current = bytearray(len(self._previous))
+                self._count = 0
+            for p in positions:
+                self._current[p >> 3] |= 1 << (p & 7)
+            self._count += 1
+            return True
+
+    def __len__(self):
+        return self._count
@@ -0,0 +1,46 @@
+"""
+Gunicorn settings for the CommonCrawl worker.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+gthread workers keep a slow /process from blocking the process: each
+request gets its own thread, and HTML parsing already runs in a process pool.
+"""
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5003)}"
+worker_class = "gthread"
+workers = int(os.getenv("WEB_WORKERS", 2))
+threads = int(os.getenv("WEB_THREADS", 8))
+
+# Más que PROCESS_TIMEOUT: /process corta sus propias consultas antes
+timeout = int(os.getenv("WEB_TIMEOUT", 200))
+# Tiempo para terminar las consultas en curso al recibir SIGTERM
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", 60))
+keepalive = int(os.getenv("WEB_KEEPALIVE", 5))
+
+# El log de acceso de gunicorn no es JSON; las peticiones ya quedan en /metrics y en las trazas
+accesslog = "-" if os.getenv("WEB_ACCESS_LOG") else None
+errorlog = "-"
+
+# /metrics suma los contadores de todos los workers (modo multiproceso de prometheus_client)
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "notibolsa-metrics-commoncrawl"))
+
+
+def on_starting(server):
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    import app
+
+    app.shutdown()
@@ -0,0 +1,88 @@
+"""
+Bucketing of article dates into day/week/month ranges.
+
+Bucket edges come from pd.date_range, starting at the day/week/month that
+contains start_date (so its first days are not dropped), and are kept as sorted int64
+nanosecond timestamps, so a single article is placed with bisect and a
+batch with np.searchsorted. Bucket i covers [edge_i, edge_i+1); the last
+bucket stays open for one full period after its edge.
+"""
+from bisect import bisect_right
+
+import numpy as np
+import pandas as pd
+
+GRANULARITIES = {
+    "day": "D",
+    "week": "W-MON",
+    "month": "MS",
+}
+
+
+def to_ns(date_news) -> int | None:
+    """Convert an article date to naive nanoseconds since the epoch, or None."""
+    try:
+        ts = pd.Timestamp(date_news)
+    except (ValueError, TypeError):
+        return None
+    if ts is pd.NaT:
+        return None
+    if ts.tzinfo is not None:
+        ts = ts.tz_localize(None)
+    return ts.value
+
+
+class DateHistogram:
+    def __init__(self, start_date: str | None, end_date: str | None, granularity: str = "month"):
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+        self.granularity = granularity
+        freq = GRANULARITIES[granularity]
+        if start_date and end_date:
+            # Primer borde: inicio del periodo que contiene start_date (lunes, día 1 o el mismo día)
+            start = pd.tseries.frequencies.to_offset(freq).rollback(pd.Timestamp(start_date).normalize())
+            edges = pd.date_range(start=start, end=end_date, freq=freq)
+        else:
+            edges = pd.DatetimeIndex([])
+        edges = edges.as_unit("ns")
+        self.labels = [d.strftime("%Y-%m-%d") for d in edges]
+        self.edges = edges.asi8
+        self._edges_list = self.edges.tolist()
+        self.upper = (edges[-1] + pd.tseries.frequencies.to_offset(freq)).value if len(edges) else None
+        self.counts = [0] * len(edges)
+        self.out_of_range = 0
+
+    def bucket(self, date_news) -> int | None:
+        """Index of the bucket that contains date_news, or None."""
+        ns = to_ns(date_news)
+        if ns is None or self.upper is None or ns >= self.upper:
+            return None
+        i = bisect_right(self._edges_list, ns) - 1
+        return i if i >= 0 else None
+
+    def add(self, date_news) -> bool:
+        i = self.bucket(date_news)
+        if i is None:
+            self.out_of_range += 1
+            return False
+        self.counts[i] += 1
+        return True
+
+    def add_many(self, dates) -> None:
+        """Bucket a batch of dates in one vectorized pass."""
+        values = [to_ns(d) for d in dates]
+        values = np.array([v for v in values if v is not None], dtype=np.int64)
+        skipped = len(dates) - len(values)
+        if self.upper is None:
+            self.out_of_range += len(dates)
+            return
+        idx = np.searchsorted(self.edges, values, side="right") - 1
+        valid = (idx >= 0) & (values < self.upper)
+        binned = np.bincount(idx[valid], minlength=len(self.counts))
+        for i, n in enumerate(binned.tolist()):
+            self.counts[i] += n
+        self.out_of_range += skipped + int((~valid).sum())
+
+    def as_list(self) -> list:
+        """[[label, count], ...] in the format of date_ranges_counts."""
+        return [[label, count] for label, count in zip(self.labels, self.counts)]
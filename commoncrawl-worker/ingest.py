@@ -0,0 +1,142 @@
+"""
+Offline bulk ingestion of El Espectador articles into the local article index.
+
+Walks every CDX page of the selected crawls for elespectador.com/*, fetches
+the WARC records (reusing the article store when a record was already
+parsed), extracts title and date in the parse process pool and writes the
+dated articles to the ArticleIndex read by /process.
+
+    python ingest.py --index CC-MAIN-2020-05 --index CC-MAIN-2020-10
+    python ingest.py --start-date 2020-01-01 --end-date 2020-12-31
+"""
+import argparse
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+import app
+from article_index import ArticleIndex
+
+INGEST_BATCH = 500
+
+log = logging.getLogger("ingest")
+
+
+def ingest_record(record: dict):
+    """Return (title, date_news, method) for a CDX record, or None if it is not an HTML page."""
+    if app.article_store is not None:
+        try:
+            article = app.article_store.lookup(record)
+        except sqlite3.Error as e:
+            log.error("Error leyendo almacén de artículos: %s", e)
+            article = None
+        if article is not None:
+            return article
+    payload = app.fetch_warc_range(record)
+    article = app.get_parse_pool().submit(app.parse_warc_record, payload).result()
+    title, date_news, method = article or (None, None, None)
+    if app.article_store is not None:
+        try:
+            app.article_store.put(record, title, date_news, method)
+        except sqlite3.Error as e:
+            log.error("Error escribiendo almacén de artículos: %s", e)
+    return article
+
+
+def iter_records(idx: str):
+    """Yield the CDX records of a crawl; pages that cannot be listed are recorded as failures."""
+    pages = int(app.cdx_page_info(idx).get("pages", 1))
+    for page in range(pages):
+        try:
+            for line in app.iter_lines(app.cdx_chunks(idx, app.cdx_url(idx, page=page))):
+                try:
+                    yield json.loads(line)
+                except Exception as e:
+                    log.warning("Error parseando línea JSON: %s", e)
+        except (requests.RequestException, app.UpstreamError) as e:
+            app.record_failure("cdx_page", idx, e, page=page)
+
+
+def ingest_index(idx: str, index: ArticleIndex, workers: int, limit: int | None = None) -> tuple[int, int]:
+    """
+    Ingest one crawl and return (records, articles). The crawl is only marked
+    as ingested when every CDX record was processed.
+    """
+    records = articles = failed = 0
+    batch = []
+
+    def collect(done):
+        nonlocal articles, failed
+        for future in done:
+            record = futures.pop(future)
+            try:
+                article = future.result()
+            except Exception as e:
+                log.error("Error procesando %s: %s", record.get("url"), e)
+                failed += 1
+                continue
+            if article is not None and article[1] is not None:
+                batch.append((record.get("url", ""), *article))
+                articles += 1
+        if len(batch) >= INGEST_BATCH:
+            index.add_batch(idx, batch)
+            batch.clear()
+
+    futures = {}
+    failures = app.FailureLog()
+    with app.failure_scope(failures), ThreadPoolExecutor(max_workers=workers) as pool:
+        for record in iter_records(idx):
+            if limit is not None and records >= limit:
+                break
+            records += 1
+            futures[pool.submit(ingest_record, record)] = record
+            if len(futures) >= workers * 4:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                collect(done)
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            collect(done)
+    index.add_batch(idx, batch)
+
+    failed += failures.count
+    if failed or limit is not None:
+        log.warning("[%s] incompleto (%d errores), no se marca como ingerido", idx, failed)
+    else:
+        index.mark_ingested(idx, records, articles)
+    return records, articles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", action="append", help="crawl to ingest (repeatable); default: planned from the dates")
+    parser.add_argument("--start-date")
+    parser.add_argument("--end-date")
+    parser.add_argument("--workers", type=int, default=app.WARC_FETCH_WORKERS, help="concurrent WARC fetches")
+    parser.add_argument("--limit", type=int, help="records per crawl (for trial runs; the crawl is not marked as ingested)")
+    parser.add_argument("--force", action="store_true", help="re-ingest crawls that are already in the index")
+    args = parser.parse_args()
+
+    if app.article_index is None:
+        parser.error("ARTICLE_INDEX_DIR is not set")
+    if args.index:
+        indices = args.index
+    elif args.start_date or args.end_date:
+        indices = app.plan_indices(args.start_date, args.end_date)["indices"]
+    else:
+        indices = app.CC_INDICES
+    if not args.force:
+        done = app.article_index.ingested()
+        indices = [idx for idx in indices if idx not in done]
+
+    for idx in indices:
+        t0 = time.monotonic()
+        records, articles = ingest_index(idx, app.article_index, args.workers, args.limit)
+        log.info("[%s] %d registros, %d artículos con fecha en %.1fs", idx, records, articles, time.monotonic() - t0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Background jobs for long /process queries.
+
+A job is a /process query run on a bounded thread pool instead of inside the
+HTTP request. Its parameters, live progress and final result are persisted in
+SQLite so clients can poll /jobs/<id> and collect the result later, from any
+process that shares the database. Progress updates double as a heartbeat, and
+queued jobs are touched periodically by the process that holds them.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+JSON_FIELDS = ("params", "progress", "result")
+
+log = logging.getLogger("jobs")
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobStore:
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "jobs.sqlite3")
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def create(self, params: dict) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, params, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, json.dumps(params), now, now),
+            )
+        return job_id
+
+    def update(self, job_id: str, **fields) -> None:
+        for name in JSON_FIELDS:
+            if name in fields:
+                fields[name] = json.dumps(fields[name])
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._conn() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def touch(self, job_ids) -> None:
+        """Refresh updated_at of the given jobs without changing anything else."""
+        now = time.time()
+        with self._conn() as conn:
+            conn.executemany("UPDATE jobs SET updated_at = ? WHERE id = ?", [(now, job_id) for job_id in job_ids])
+
+    def get(self, job_id: str, stale_after: float | None = None) -> dict | None:
+        """
+        Return a job, or None if it does not exist. A queued or running job
+        that has not been updated for `stale_after` seconds belonged to a
+        process that died, and is reported (and stored) as failed.
+        """
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        if stale_after is not None and job["status"] in ("queued", "running") and job["updated_at"] < time.time() - stale_after:
+            self.update(job_id, status="failed", error="interrupted")
+            job.update(status="failed", error="interrupted")
+        for name in JSON_FIELDS:
+            job[name] = json.loads(job[name]) if job[name] is not None else None
+        return job
+
+    def purge(self, retention: float) -> None:
+        """Drop jobs not updated for `retention` seconds."""
+        with self._conn() as conn:
+            conn.execute("DELETE FROM jobs WHERE updated_at < ?", (time.time() - retention,))
+
+
+class JobRunner:
+    """
+    Runs jobs on `workers` threads with at most `queue_size` jobs waiting.
+    `run(params, state)` does the work; `make_state()` returns an object with
+    a snapshot() method whose output is persisted as the job's progress every
+    `progress_interval` seconds; queued jobs are touched at the same interval.
+    """
+
+    def __init__(self, store: JobStore, run, make_state, workers: int, queue_size: int, progress_interval: float):
+        self.store = store
+        self.run = run
+        self.make_state = make_state
+        self.capacity = workers + queue_size
+        self.progress_interval = progress_interval
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._pending = 0
+        self._queued = set()
+        self._running = set()
+        self._closing = False
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._heartbeat = None
+
+    def submit(self, params: dict) -> str:
+        with self._lock:
+            if self._closing or self._pending >= self.capacity:
+                raise JobQueueFull()
+            self._pending += 1
+        job_id = self.store.create(params)
+        with self._lock:
+            self._queued.add(job_id)
+            # El latido arranca con el primer job, no al importar (los workers se crean con fork)
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._keep_queued_alive, daemon=True)
+                self._heartbeat.start()
+        self._pool.submit(self._run, job_id, params)
+        return job_id
+
+    def shutdown(self) -> None:
+        """
+        Stop accepting jobs, cancel the running ones and record them and the
+        queued ones as failed ("interrupted"), so clients do not wait for the
+        stale timeout.
+        """
+        with self._lock:
+            self._closing = True
+            running = list(self._running)
+        self._stopped.set()
+        for state in running:
+            state.stop_event.set()
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        for job_id in self._queued:
+            self.store.update(job_id, status="failed", error="interrupted")
+
+    def _keep_queued_alive(self) -> None:
+        while not self._stopped.wait(self.progress_interval):
+            with self._lock:
+                queued = list(self._queued)
+            if not queued:
+                continue
+            try:
+                self.store.touch(queued)
+            except sqlite3.Error as e:
+                log.error("Error actualizando jobs en cola: %s", e)
+
+    def _run(self, job_id: str, params: dict) -> None:
+        state = self.make_state()
+        done = threading.Event()
+        with self._lock:
+            self._queued.discard(job_id)
+            if self._closing:
+                self._pending -= 1
+                self.store.update(job_id, status="failed", error="interrupted")
+                return
+            self._running.add(state)
+
+        def report():
+            while not done.wait(self.progress_interval):
+                try:
+                    self.store.update(job_id, progress=state.snapshot())
+                except sqlite3.Error as e:
+                    log.error("Error guardando progreso del job %s: %s", job_id, e)
+
+        reporter = threading.Thread(target=report, daemon=True)
+        try:
+            self.store.update(job_id, status="running")
+            reporter.start()
+            outcome = {"status": "done", "result": self.run(params, state)}
+            if self._closing:
+                outcome = {"status": "failed", "error": "interrupted"}
+        except Exception as e:
+            log.exception("Job %s falló: %s", job_id, e)
+            outcome = {"status": "failed", "error": str(e)}
+        finally:
+            done.set()
+            if reporter.is_alive():
+                reporter.join()
+            with self._lock:
+                self._pending -= 1
+                self._running.discard(state)
+        self.store.update(job_id, progress=state.snapshot(), **outcome)
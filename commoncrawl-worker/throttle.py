@@ -0,0 +1,93 @@
+"""
+Adaptive request rate per upstream host (index.commoncrawl.org, data.commoncrawl.org).
+
+Each host gets a token bucket whose rate follows AIMD: every successful
+response adds `increase / rate` (about `increase` requests/s per second of
+sustained success) and every throttling answer multiplies the rate by
+`decrease`. Decreases are applied at most once per second, so a burst of
+503s from requests that were already in flight counts as a single signal.
+A Retry-After header pauses the whole host until it expires.
+"""
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+def retry_after(value: str | None, limit: float) -> float | None:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), capped at `limit`."""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), limit)
+
+
+def backoff(attempt: int, base: float, limit: float) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(limit, base * 2**attempt)]."""
+    return random.uniform(0, min(limit, base * (2 ** attempt)))
+
+
+class HostLimiter:
+    def __init__(self, rate: float, min_rate: float, max_rate: float, increase: float, decrease: float):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        # Ráfaga máxima: un segundo de tasa (al menos una petición)
+        self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, stop_event: threading.Event | None = None, deadline: float | None = None) -> float | None:
+        """
+        Block until the host may be sent one more request; returns the seconds waited.
+        Returns None instead if stop_event is set or the wait would pass `deadline`
+        (a time.monotonic() value).
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return waited
+                    wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return None
+            if stop_event is None:
+                time.sleep(wait)
+            elif stop_event.wait(wait):
+                return None
+            waited += wait
+
+    def succeeded(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def throttled(self, pause: float | None = None) -> None:
+        """Back off after a 429/5xx or a timeout; `pause` comes from Retry-After."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease >= 1.0:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._last_decrease = now
+            if pause:
+                self._paused_until = max(self._paused_until, now + pause)
+                self._tokens = 0.0